@@ -14,6 +14,9 @@ gunicorn server.wsgi:application --bind 0.0.0.0:8000 --workers=2 &
 
 # celery worker
 celery -A server worker -Q wrf_stilt --concurrency=1 --hostname=wrf_stilt_worker@%h &
+# stilt worker, STILT_FANOUT=true 时运行分发的 STILT 作业, 可在其他节点运行更多 worker
+# (其他节点需设置 API_BASE_URL, CELERY_BROKER_URL 并共享 STILT_WD 和数据目录)
+celery -A server worker -Q stilt --concurrency=${STILT_WORKER_CONCURRENCY:-1} --hostname=stilt_worker@%h &
 
 # celery beat
 celery -A server beat --loglevel=info &
@@ -2,7 +2,7 @@ from django.contrib import admin
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
-from .models import ModelWrfStilt, Receptor, Region
+from .models import FootprintCatalog, ModelWrfStilt, Receptor, Region
 
 admin.site.site_header = "MODEL-Admin"
 admin.site.site_title = "MODEL-Admin"
@@ -38,6 +38,13 @@ class ModelWrfStiltAdmin(admin.ModelAdmin):
     list_display = ("name", "description", "xres", "yres", "n_cores", "wrf_file_retention_days")
 
 
+class FootprintCatalogAdmin(admin.ModelAdmin):
+    readonly_fields = ("update_time", "create_time")
+    list_display = ("receptor", "valid_time", "cell_count", "total", "max_value", "path")
+    list_filter = ("receptor",)
+
+
 admin.site.register(Region, RegionAdmin)
 admin.site.register(Receptor, ReceptorAdmin)
 admin.site.register(ModelWrfStilt, ModelWrfStiltAdmin)
+admin.site.register(FootprintCatalog, FootprintCatalogAdmin)
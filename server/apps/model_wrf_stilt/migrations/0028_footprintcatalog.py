@@ -0,0 +1,99 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        (
+            "model_wrf_stilt",
+            "0027_remove_emissioncontributiondata_pollutant_source_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FootprintCatalog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "create_time",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="创建时间",
+                        verbose_name="创建时间",
+                    ),
+                ),
+                (
+                    "update_time",
+                    models.DateTimeField(
+                        auto_now=True, help_text="修改时间", verbose_name="修改时间"
+                    ),
+                ),
+                (
+                    "is_deleted",
+                    models.BooleanField(
+                        default=False, help_text="选中表示删除", verbose_name="是否删除"
+                    ),
+                ),
+                ("valid_time", models.DateTimeField(verbose_name="足迹时间")),
+                ("path", models.CharField(max_length=500, verbose_name="文件路径")),
+                (
+                    "cell_count",
+                    models.IntegerField(default=0, verbose_name="有效网格数"),
+                ),
+                ("total", models.FloatField(default=0.0, verbose_name="足迹总和")),
+                (
+                    "max_value",
+                    models.FloatField(default=0.0, verbose_name="足迹最大值"),
+                ),
+                (
+                    "min_lng",
+                    models.FloatField(blank=True, null=True, verbose_name="最小经度"),
+                ),
+                (
+                    "max_lng",
+                    models.FloatField(blank=True, null=True, verbose_name="最大经度"),
+                ),
+                (
+                    "min_lat",
+                    models.FloatField(blank=True, null=True, verbose_name="最小纬度"),
+                ),
+                (
+                    "max_lat",
+                    models.FloatField(blank=True, null=True, verbose_name="最大纬度"),
+                ),
+                (
+                    "receptor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="footprints",
+                        to="model_wrf_stilt.receptor",
+                        verbose_name="受体",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "足迹索引",
+                "verbose_name_plural": "足迹索引管理",
+                "db_table": "w_footprint_catalog",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("receptor", "valid_time"),
+                        name="unique_footprint_receptor_time",
+                    )
+                ],
+            },
+        ),
+    ]
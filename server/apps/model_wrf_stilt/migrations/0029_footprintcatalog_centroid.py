@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("model_wrf_stilt", "0028_footprintcatalog"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="footprintcatalog",
+            name="centroid_lat",
+            field=models.FloatField(blank=True, null=True, verbose_name="加权中心纬度"),
+        ),
+        migrations.AddField(
+            model_name="footprintcatalog",
+            name="centroid_lng",
+            field=models.FloatField(blank=True, null=True, verbose_name="加权中心经度"),
+        ),
+    ]
@@ -132,6 +132,48 @@ class Receptor(BaseModel):
         return self.name
 
 
+class FootprintCatalog(BaseModel):
+    """足迹文件索引, 由 run_instance 在转换足迹后写入"""
+
+    receptor = models.ForeignKey(
+        Receptor,
+        on_delete=models.CASCADE,
+        related_name="footprints",
+        verbose_name=_("受体"),
+    )
+    valid_time = models.DateTimeField(verbose_name=_("足迹时间"))
+    path = models.CharField(max_length=500, verbose_name=_("文件路径"))
+    cell_count = models.IntegerField(verbose_name=_("有效网格数"), default=0)
+    total = models.FloatField(verbose_name=_("足迹总和"), default=0.0)
+    max_value = models.FloatField(verbose_name=_("足迹最大值"), default=0.0)
+    min_lng = models.FloatField(verbose_name=_("最小经度"), null=True, blank=True)
+    max_lng = models.FloatField(verbose_name=_("最大经度"), null=True, blank=True)
+    min_lat = models.FloatField(verbose_name=_("最小纬度"), null=True, blank=True)
+    max_lat = models.FloatField(verbose_name=_("最大纬度"), null=True, blank=True)
+    centroid_lng = models.FloatField(verbose_name=_("加权中心经度"), null=True, blank=True)
+    centroid_lat = models.FloatField(verbose_name=_("加权中心纬度"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("足迹索引")
+        verbose_name_plural = _("足迹索引管理")
+        db_table = "w_footprint_catalog"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["receptor", "valid_time"], name="unique_footprint_receptor_time"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.receptor_id} {self.valid_time:%Y%m%d%H%M}"
+
+    @property
+    def bounds(self):
+        """与 Footprint.bounds 一致: [[min_lat, min_lng], [max_lat, max_lng]], 无有效网格时为 None"""
+        if self.min_lat is None:
+            return None
+        return [[self.min_lat, self.min_lng], [self.max_lat, self.max_lng]]
+
+
 # class PollutantSource(BaseModel):
 #     """污染源模型"""
 
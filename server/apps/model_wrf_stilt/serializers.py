@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from .models import ModelWrfStilt, Receptor, Region
+from .models import FootprintCatalog, ModelWrfStilt, Receptor, Region
 
 
 class RegionSerializer(serializers.ModelSerializer):
@@ -31,3 +31,11 @@ class ModelWRFStiltSerializer(serializers.ModelSerializer):
     class Meta:
         model = ModelWrfStilt
         fields = "__all__"
+
+
+class FootprintCatalogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FootprintCatalog
+        fields = "__all__"
+        # 已有的 (receptor, valid_time) 由 bulk_upsert 更新, 不在校验时拒绝
+        validators = []
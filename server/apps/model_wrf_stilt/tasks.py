@@ -1,11 +1,22 @@
 import sys
 
+import config
 import pendulum
-from celery import shared_task
+from celery import chord, shared_task
+from loguru import logger
 
 sys.path.append("../../")
 # from tasks.wrf_stilt_aermod_task.main import run as wrf_stilt_run
+from tasks.wrf_stilt_aermod_task.crud import get_model_config
 from tasks.wrf_stilt_aermod_task.main import run as wrf_stilt_run
+from tasks.wrf_stilt_aermod_task.run_stilt import (
+    build_stilt_jobs,
+    clean_old_job_dirs,
+    dump_job,
+    load_job,
+    prepare_stilt,
+    run_stilt_job,
+)
 
 
 @shared_task(name="wrf_stilt_task", bind=True)
@@ -13,5 +24,59 @@ def run_wrf_stilt_task(self, *args, **kwargs):
     if not kwargs.get("run_date"):
         scheduled_time = pendulum.now("UTC").start_of("hour").to_datetime_string()
         kwargs["run_date"] = scheduled_time
+    # STILT 分发为子任务时, 本任务只运行 WRF 和 ARL 转换, 不等待 STILT 完成
+    fanout = config.STILT_FANOUT and kwargs.get("stilt", True)
+    if fanout:
+        kwargs["stilt"] = False
     wrf_stilt_run(*args, **kwargs)
+    if fanout:
+        count = dispatch_stilt_jobs(
+            receptor_ids=kwargs.get("receptor_ids"),
+            batch=kwargs.get("stilt_batch", config.STILT_BATCH_RUN),
+            resume=not kwargs.get("force", False),
+        )
+        return f"WRF task completed, {count} STILT jobs dispatched"
     return "WRF-STILT task completed"
+
+
+def dispatch_stilt_jobs(
+    receptor_ids=None, batch: bool = config.STILT_BATCH_RUN, resume: bool = True
+) -> int:
+    """
+    转换 ARL 后将各受体 (或同一区域的一组受体) 的 STILT 作业分发到 stilt 队列,
+    全部完成后由 stilt_cycle_callback 汇总状态; 作业目录和 arlout 需在各 worker 间共享
+    """
+    model_config = get_model_config()
+    t_start, t_end = prepare_stilt(model_config)
+    jobs = build_stilt_jobs(
+        model_config, t_start, t_end, receptor_ids=receptor_ids, batch=batch, resume=resume
+    )
+    if not jobs:
+        return 0
+    cycle = t_start.format("YYYYMMDDHH")
+    chord(run_stilt_job_task.s(dump_job(job), batch) for job in jobs)(stilt_cycle_callback.s(cycle))
+    logger.info(f"STILT cycle {cycle}: {len(jobs)} jobs dispatched")
+    return len(jobs)
+
+
+@shared_task(name="stilt_job_task", bind=True)
+def run_stilt_job_task(self, job: list, batch: bool):
+    return run_stilt_job(load_job(job), batch=batch)
+
+
+@shared_task(name="stilt_cycle_callback", bind=True)
+def stilt_cycle_callback(self, results: list, cycle: str):
+    """汇总一个周期所有 STILT 作业的状态"""
+    failed = [r for r in results if not r["ok"]]
+    summary = {
+        "cycle": cycle,
+        "jobs": len(results),
+        "receptors": sum(len(r["receptor_ids"]) for r in results),
+        "failed": failed,
+    }
+    if failed:
+        logger.error(f"STILT cycle {cycle}: {len(failed)} of {len(results)} jobs failed")
+    else:
+        logger.info(f"STILT cycle {cycle}: {len(results)} jobs completed")
+    clean_old_job_dirs()
+    return summary
@@ -2,9 +2,11 @@ from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from .views import (  # PollutantSourceViewSet,
+    FootprintCatalogViewSet,
     ModelWRFStiltViewSet,
     ReceptorViewSet,
     RegionViewSet,
+    footprint_tile_view,
     tool_page_view,
 )
 
@@ -12,9 +14,15 @@ router = DefaultRouter()
 router.register(r"model_wrf_stilt", ModelWRFStiltViewSet)
 router.register(r"region", RegionViewSet)
 router.register(r"receptor", ReceptorViewSet)
+router.register(r"footprint_catalog", FootprintCatalogViewSet)
 # router.register(r"pollutant_source", PollutantSourceViewSet)
 
 urlpatterns = router.urls
 urlpatterns += [
     path("tool/", tool_page_view, name="tool_page"),
+    path(
+        "footprint_tiles/<int:receptor_id>/<str:time>/<int:z>/<int:x>/<int:y>.png",
+        footprint_tile_view,
+        name="footprint_tile",
+    ),
 ]
@@ -1,6 +1,9 @@
+from pathlib import Path
+
 import pendulum
 from celery import current_app
 from django.db import transaction
+from django.db.models import Max, Min
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
@@ -8,14 +11,16 @@ from loguru import logger
 from rest_framework import serializers, viewsets
 from rest_framework.decorators import action
 from tasks.wrf_stilt_aermod_task.utils import create_domains
-from utils import utils_netcdf
+from utils import utils_format, utils_http, utils_netcdf, utils_tiles
 
 from .models import (  # EmissionContributionData,; PollutantSource,
+    FootprintCatalog,
     ModelWrfStilt,
     Receptor,
     Region,
 )
 from .serializers import (  # EmissionContributionDataSerializer,; PollutantSourceSerializer,
+    FootprintCatalogSerializer,
     ModelWRFStiltSerializer,
     ReceptorSerializer,
     RegionSerializer,
@@ -32,6 +37,23 @@ class TaskCreationSerializer(serializers.Serializer):
     run_wrf = serializers.BooleanField(required=False, default=True)
     run_stilt = serializers.BooleanField(required=False, default=True)
     run_aermod = serializers.BooleanField(required=False, default=True)
+    # 重新计算所有受体小时, 默认只计算缺少足迹的受体小时
+    force = serializers.BooleanField(required=False, default=False)
+
+
+def parse_time(time: str) -> pendulum.DateTime:
+    """YYYYMMDDHHmm (UTC)"""
+    return pendulum.from_format(time[:12], "YYYYMMDDHHmm", tz="UTC")
+
+
+def footprint_file(receptor: Receptor, time: str, entry: FootprintCatalog = None) -> Path:
+    """足迹文件, 优先使用足迹索引中的路径, 未索引的旧文件或路径无效时按文件名查找"""
+    file = utils_netcdf.catalog_file(entry.path) if entry is not None else None
+    if file is not None:
+        return file
+    return utils_netcdf.parse_file_name(
+        time=time, lng=receptor.longitude, lat=receptor.latitude, hight=int(receptor.height)
+    )
 
 
 class ModelWRFStiltViewSet(viewsets.ModelViewSet):
@@ -72,6 +94,7 @@ class ModelWRFStiltViewSet(viewsets.ModelViewSet):
             stilt=validated_data["run_stilt"],
             receptor_ids=validated_data["receptor_ids"],
             aermod=validated_data["run_aermod"],
+            force=validated_data["force"],
         )
         return JsonResponse({
             "message": "Task created, please wait for completion",
@@ -100,31 +123,89 @@ class ModelWRFStiltViewSet(viewsets.ModelViewSet):
     def get_stilt_data(self, request):
         """
         Get STILT model data for a specific receptor
+        layer: sum (default) sums the footprint time layers, all keeps them in a "t" column,
+        an integer selects a single layer
+        level / zoom: serve a block-aggregated pyramid level (2 ** level), or the level matching
+        a web map zoom; only with layer=sum
+        resp_type: json (default), arrow, binary or png, see utils_format
+        bbox (min_lng,min_lat,max_lng,max_lat) / min_value / top_n: only return the cells in
+        the box, with a value not below min_value, or the top_n cells by value
         """
         try:
+            layer = utils_netcdf.parse_layer(request.query_params.get("layer"))
+            filters = utils_netcdf.parse_filters(request.query_params)
+            level = request.query_params.get("level")
+            level = int(level) if level else None
+            zoom = request.query_params.get("zoom")
+            zoom = int(zoom) if zoom else None
+            if zoom is not None and zoom < 0:
+                raise ValueError("zoom must not be negative")
             time = request.query_params.get("time")
+            valid_time = parse_time(time) if time else None
+            fmt = utils_format.negotiate_format(request, request.query_params.get("resp_type"))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except utils_format.FormatNotAvailable as e:
+            return JsonResponse({"error": str(e)}, status=406)
+        encoding = utils_format.negotiate_encoding(request, fmt)
+        try:
             receptor_id = request.query_params.get("receptor_id")
-            resp_type = request.query_params.get("resp_type")
             if not all([time, receptor_id]):
                 return JsonResponse(
                     {"error": "Missing required parameters: time and receptor_id"}, status=400
                 )
 
             receptor = Receptor.objects.get(id=receptor_id)
-            lng = receptor.longitude
-            lat = receptor.latitude
-            height = receptor.height
-            file = utils_netcdf.parse_file_name(time=time, lng=lng, lat=lat, hight=int(height))
-            data = utils_netcdf.get_nc_data(file)
-            lng = [row[0] for row in data["data"]]
-            lat = [row[1] for row in data["data"]]
-            data["bounds"] = [[min(lat), min(lng)], [max(lat), max(lng)]]
-
-            if resp_type == "png":
-                buffer = utils_netcdf.stilt_to_png(data)
-                return HttpResponse(buffer.getvalue(), content_type="image/png")
+            entry = FootprintCatalog.objects.filter(
+                receptor=receptor, valid_time=valid_time
+            ).first()
+            file = footprint_file(receptor, time, entry)
+            footprint = utils_netcdf.load_footprint(file)
+            if layer == "sum":
+                level = utils_netcdf.pyramid_level(footprint, level=level, zoom=zoom)
+                file, level = utils_netcdf.find_pyramid_file(file, level)
+                if level:
+                    footprint = utils_netcdf.load_footprint(file)
+            else:
+                level = 0
+            validators = utils_http.file_validators(
+                [file],
+                utils_netcdf.hour_end(time),
+                fmt,
+                encoding,
+                layer,
+                level,
+                utils_netcdf.filters_key(filters),
+            )
+            response = utils_http.not_modified(request, validators)
+            if response:
+                return response
+
+            footprint = utils_netcdf.apply_layer(footprint, layer).filter(**filters)
+            # 原始网格的范围与时间层无关, 直接使用索引中的范围
+            if (
+                entry is not None
+                and file == utils_netcdf.catalog_file(entry.path)
+                and not level
+                and not utils_netcdf.filters_key(filters)
+            ):
+                bounds = entry.bounds
+            else:
+                bounds = footprint.bounds()
+            meta = {"bounds": bounds, "level": level}
+            if fmt == "png":
+                data = footprint.to_dict()
+                data.update(meta)
+                buffer = utils_netcdf.stilt_to_png(
+                    data, rect_unit=max(0.005, footprint.resolution) if level else 0.005
+                )
+                body = buffer.getvalue()
             else:
-                return JsonResponse(data)
+                body = utils_format.encode_footprint(
+                    footprint, fmt, meta, with_layers=layer == "all"
+                )
+            response = utils_format.make_response(body, fmt, encoding)
+            return utils_http.set_cache_headers(response, validators)
         except Exception as e:
             return JsonResponse({"error": str(e)}, status=500)
 
@@ -132,59 +213,237 @@ class ModelWRFStiltViewSet(viewsets.ModelViewSet):
     def get_stilt_merge_data(self, request):
         """
         Get merged STILT data for a specific receptor over multiple time periods
+        layer: sum (default) sums the footprint time layers, an integer selects a single layer
+        resp_type: json (default), arrow, binary or png, see utils_format
+        bbox / min_value / top_n: filter the merged cells, see get_stilt_data
         """
         st = request.query_params.get("st")
         et = request.query_params.get("et")
         receptor_id = request.query_params.get("receptor_id")
-        resp_type = request.query_params.get("resp_type")
         if not all([st, et, receptor_id]):
             return JsonResponse(
                 {"error": "Missing required parameters: st, et, receptor_id"}, status=400
             )
-        st = pendulum.from_format(st, "YYYYMMDDHHmm")
-        et = pendulum.from_format(et, "YYYYMMDDHHmm")
-
-        if receptor_id:
+        try:
+            layer = utils_netcdf.parse_layer(request.query_params.get("layer"))
+            if layer == "all":
+                raise ValueError("layer=all is not supported when merging")
+            filters = utils_netcdf.parse_filters(request.query_params)
+            fmt = utils_format.negotiate_format(request, request.query_params.get("resp_type"))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except utils_format.FormatNotAvailable as e:
+            return JsonResponse({"error": str(e)}, status=406)
+        encoding = utils_format.negotiate_encoding(request, fmt)
+        try:
+            st, et = parse_time(st), parse_time(et)
             receptor = Receptor.objects.get(id=receptor_id)
-            lng = receptor.longitude
-            lat = receptor.latitude
-            height = int(receptor.height)
-
-        all_data = []
-        all_data_dict = {}
-        columns = []
-        not_exist_files = []
-        while st < et:
-            tm_str = st.format("YYYYMMDDHHmm")[:-2] + "00"
-            try:
-                file = utils_netcdf.parse_file_name(time=tm_str, lng=lng, lat=lat, hight=height)
-                data = utils_netcdf.get_nc_data(file)
-                value_data = data["data"]
-                columns = data["columns"]
-                for i in value_data:
-                    grid_key = f"{i[0]}:{i[1]}"
-                    all_data_dict.setdefault(grid_key, []).append(i[2])
-                st = st.add(hours=1)
-            except Exception as e:
-                logger.error(e)
-                not_exist_files.append(tm_str)
-                st = st.add(hours=1)
-                continue
-
-        for k in all_data_dict:
-            [lng, lat] = k.split(":")
-            avg_val = sum(all_data_dict[k]) / len(all_data_dict[k])
-            all_data.append([float(lng), float(lat), avg_val])
-        data = {"columns": columns, "data": all_data}
-        lng = [row[0] for row in data["data"]]
-        lat = [row[1] for row in data["data"]]
-        data["bounds"] = [[min(lat), min(lng)], [max(lat), max(lng)]]
-
-        if resp_type == "png":
-            buffer = utils_netcdf.stilt_to_png(data)
-            return HttpResponse(buffer.getvalue(), content_type="image/png")
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except Receptor.DoesNotExist:
+            return JsonResponse({"error": "Receptor not found"}, status=404)
+        cache_key = utils_netcdf.merge_cache_key(
+            st,
+            et,
+            lng=receptor.longitude,
+            lat=receptor.latitude,
+            hight=int(receptor.height),
+            resp_type=fmt,
+            layer=layer,
+            filters=filters,
+        )
+        validators = utils_http.file_validators(
+            utils_netcdf.merge_source_files(
+                st, et, lng=receptor.longitude, lat=receptor.latitude, hight=int(receptor.height)
+            ),
+            et,
+            cache_key,
+            encoding,
+        )
+        response = utils_http.not_modified(request, validators)
+        if response:
+            return response
+        # 缓存未压缩的内容
+        cached = utils_netcdf.merge_cache.get(cache_key)
+        if cached:
+            body, _ = cached
+            response = utils_format.make_response(body, fmt, encoding)
+            return utils_http.set_cache_headers(response, validators)
+
+        region = receptor.region
+        model = ModelWrfStilt.objects.first()
+        # 足迹网格与 run_stilt.r 一致: 区域范围, yres 取 xres
+        xres = model.xres if model else 0.001
+        grid = dict(
+            xmn=region.xmn, xmx=region.xmx, ymn=region.ymn, ymx=region.ymx, xres=xres, yres=xres
+        )
+        entries = FootprintCatalog.objects.filter(
+            receptor=receptor, valid_time__gte=st, valid_time__lt=et
+        )
+        # 索引从 st 之前开始时按索引规划读取的小时, 否则 (建立索引前的旧数据) 按文件名查找
+        files, fallback = {}, []
+        if FootprintCatalog.objects.filter(receptor=receptor, valid_time__lte=st).exists():
+            for e in entries.only("valid_time", "path"):
+                hour = pendulum.instance(e.valid_time).format("YYYYMMDDHH00")
+                file = utils_netcdf.catalog_file(e.path)
+                if file is None:
+                    # 索引中的路径无效时按文件名查找
+                    fallback.append(hour)
+                    try:
+                        file = utils_netcdf.parse_file_name(
+                            hour, receptor.longitude, receptor.latitude, int(receptor.height)
+                        )
+                    except FileNotFoundError:
+                        continue
+                files[hour] = file
+        footprint, not_exist_files = utils_netcdf.merge_footprints(
+            st,
+            et,
+            lng=receptor.longitude,
+            lat=receptor.latitude,
+            hight=int(receptor.height),
+            layer=layer,
+            grid=grid,
+            files=files or None,
+        )
+        if len(footprint) == 0:
+            return JsonResponse(
+                {"error": "No STILT data found", "not_exist_files": not_exist_files}, status=404
+            )
+        footprint = footprint.filter(**filters)
+        hours = int((et - st).total_seconds() // 3600)
+        # 所有有数据的小时都已索引时, 合并结果的范围为各小时范围的并集
+        if (
+            files
+            and not fallback
+            and len(files) == hours - len(not_exist_files)
+            and not utils_netcdf.filters_key(filters)
+        ):
+            bounds = entries.aggregate(
+                Min("min_lat"), Min("min_lng"), Max("max_lat"), Max("max_lng")
+            )
+            bounds = [
+                [bounds["min_lat__min"], bounds["min_lng__min"]],
+                [bounds["max_lat__max"], bounds["max_lng__max"]],
+            ]
         else:
-            return JsonResponse(data)
+            bounds = footprint.bounds()
+        meta = {"bounds": bounds}
+        if fmt == "png":
+            data = footprint.to_dict()
+            data.update(meta)
+            body = utils_netcdf.stilt_to_png(data).getvalue()
+        else:
+            body = utils_format.encode_footprint(footprint, fmt, meta)
+        utils_netcdf.merge_cache.set(cache_key, body, utils_format.CONTENT_TYPES[fmt])
+        response = utils_format.make_response(body, fmt, encoding)
+        return utils_http.set_cache_headers(response, validators)
+
+    @action(detail=False, methods=["get"])
+    def get_stilt_batch_data(self, request):
+        """
+        Get the STILT footprints of several receptors at one time
+        receptor_ids: comma separated receptor ids, at most STILT_BATCH_MAX_RECEPTORS
+        sum: true returns the cell-wise sum over the receptors as a single footprint
+        layer / bbox / min_value / top_n: see get_stilt_data, filters apply after summing
+        resp_type: json (default), arrow or binary, see utils_format; png only with sum=true
+        """
+        try:
+            layer = utils_netcdf.parse_layer(request.query_params.get("layer"))
+            filters = utils_netcdf.parse_filters(request.query_params)
+            receptor_ids = utils_netcdf.parse_receptor_ids(request.query_params.get("receptor_ids"))
+            summed = request.query_params.get("sum", "").lower() in ("1", "true")
+            fmt = utils_format.negotiate_format(request, request.query_params.get("resp_type"))
+            if summed and layer == "all":
+                raise ValueError("layer=all is not supported when summing")
+            if fmt == "png" and not summed:
+                raise ValueError("resp_type=png requires sum=true")
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        except utils_format.FormatNotAvailable as e:
+            return JsonResponse({"error": str(e)}, status=406)
+        time = request.query_params.get("time")
+        if not all([time, receptor_ids]):
+            return JsonResponse(
+                {"error": "Missing required parameters: time and receptor_ids"}, status=400
+            )
+        encoding = utils_format.negotiate_encoding(request, fmt)
+
+        receptors = {
+            r[0]: r
+            for r in Receptor.objects.filter(id__in=receptor_ids).values_list(
+                "id", "longitude", "latitude", "height"
+            )
+        }
+        not_found = [i for i in receptor_ids if i not in receptors]
+        try:
+            valid_time = parse_time(time)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        # 路径无效的索引项按文件名查找
+        catalog = {
+            receptor_id: file
+            for receptor_id, path in FootprintCatalog.objects.filter(
+                receptor_id__in=receptors, valid_time=valid_time
+            ).values_list("receptor_id", "path")
+            if (file := utils_netcdf.catalog_file(path)) is not None
+        }
+        files, missing = utils_netcdf.receptor_files(
+            time,
+            [
+                (i, *receptors[i][1:3], int(receptors[i][3]))
+                for i in receptor_ids
+                if i in receptors and i not in catalog
+            ],
+        )
+        # 按请求的顺序
+        files = {
+            i: catalog[i] if i in catalog else files[i]
+            for i in receptor_ids
+            if i in catalog or i in files
+        }
+        if not files:
+            return JsonResponse(
+                {"error": "No STILT data found", "not_found": not_found, "missing": missing},
+                status=404,
+            )
+        validators = utils_http.file_validators(
+            files.values(),
+            utils_netcdf.hour_end(time),
+            fmt,
+            encoding,
+            layer,
+            summed,
+            utils_netcdf.filters_key(filters),
+            ",".join(str(i) for i in receptor_ids),
+            # 缺失的足迹生成后响应随之变化
+            ",".join(str(i) for i in missing),
+        )
+        response = utils_http.not_modified(request, validators)
+        if response:
+            return response
+
+        footprints = utils_netcdf.load_footprints(files, layer)
+        meta = {"not_found": not_found, "missing": missing}
+        if summed:
+            footprint = utils_netcdf.total_footprints(footprints.values()).filter(**filters)
+            meta.update(receptor_ids=list(footprints), bounds=footprint.bounds())
+            if fmt == "png":
+                data = footprint.to_dict()
+                data.update(meta)
+                body = utils_netcdf.stilt_to_png(data).getvalue()
+            else:
+                body = utils_format.encode_footprint(footprint, fmt, meta)
+        else:
+            items = []
+            for receptor_id, footprint in footprints.items():
+                footprint = footprint.filter(**filters)
+                items.append(
+                    ({"receptor_id": receptor_id, "bounds": footprint.bounds()}, footprint)
+                )
+            body = utils_format.encode_footprints(items, fmt, meta, with_layers=layer == "all")
+        response = utils_format.make_response(body, fmt, encoding)
+        return utils_http.set_cache_headers(response, validators)
 
 
 class RegionViewSet(viewsets.ModelViewSet):
@@ -221,6 +480,133 @@ class ReceptorViewSet(viewsets.ModelViewSet):
             return JsonResponse({"error": str(e)}, status=500)
 
 
+class FootprintCatalogViewSet(viewsets.ModelViewSet):
+    queryset = FootprintCatalog.objects.all()
+    serializer_class = FootprintCatalogSerializer
+    permission_classes = []
+    authentication_classes = []
+
+    def get_queryset(self):
+        """receptor_id / st / et (YYYYMMDDHHmm, [st, et)) filter the catalog"""
+        queryset = super().get_queryset().order_by("receptor_id", "valid_time")
+        receptor_id = self.request.query_params.get("receptor_id")
+        st = self.request.query_params.get("st")
+        et = self.request.query_params.get("et")
+        if receptor_id:
+            queryset = queryset.filter(receptor_id=receptor_id)
+        try:
+            if st:
+                queryset = queryset.filter(valid_time__gte=parse_time(st))
+            if et:
+                queryset = queryset.filter(valid_time__lt=parse_time(et))
+        except ValueError as e:
+            raise serializers.ValidationError({"error": str(e)})
+        return queryset
+
+    @action(detail=False, methods=["post"])
+    def bulk_upsert(self, request):
+        """
+        Create or update catalog entries by (receptor, valid_time).
+        Data format: [{"receptor": 1, "valid_time": "...", "path": "...", ...}, ...]
+        """
+        if not isinstance(request.data, list):
+            return JsonResponse({"error": "Data should be a list of objects."}, status=400)
+        serializer = FootprintCatalogSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400, safe=False)
+        entries = [FootprintCatalog(**item) for item in serializer.validated_data]
+        FootprintCatalog.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=["receptor", "valid_time"],
+            update_fields=[
+                "path",
+                "cell_count",
+                "total",
+                "max_value",
+                "min_lng",
+                "max_lng",
+                "min_lat",
+                "max_lat",
+                "centroid_lng",
+                "centroid_lat",
+                "update_time",
+            ],
+        )
+        return JsonResponse({"message": "Upsert successful", "count": len(entries)})
+
+    @action(detail=False, methods=["get"])
+    def availability(self, request):
+        """
+        Hours in [st, et) (YYYYMMDDHHmm) with and without a catalogued footprint of a receptor
+        """
+        receptor_id = request.query_params.get("receptor_id")
+        st = request.query_params.get("st")
+        et = request.query_params.get("et")
+        if not all([receptor_id, st, et]):
+            return JsonResponse(
+                {"error": "Missing required parameters: st, et, receptor_id"}, status=400
+            )
+        try:
+            st, et = parse_time(st), parse_time(et)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        times = [
+            pendulum.instance(t).format("YYYYMMDDHHmm")
+            for t in self.get_queryset().values_list("valid_time", flat=True)
+        ]
+        available = set(times)
+        missing = []
+        time = st.start_of("hour")
+        while time < et:
+            if time.format("YYYYMMDDHHmm") not in available:
+                missing.append(time.format("YYYYMMDDHHmm"))
+            time = time.add(hours=1)
+        return JsonResponse({"times": times, "missing": missing})
+
+    @action(detail=False, methods=["get"])
+    def summary(self, request):
+        """
+        Hourly summary time series of receptors in [st, et) (YYYYMMDDHHmm), read from the catalog
+        receptor_ids: comma separated receptor ids
+        Response: {"receptors": [{"receptor_id": 1, "times": [...], "total": [...], "max_value": [...],
+        "cell_count": [...], "centroid_lng": [...], "centroid_lat": [...]}, ...]}
+        """
+        st = request.query_params.get("st")
+        et = request.query_params.get("et")
+        try:
+            receptor_ids = utils_netcdf.parse_receptor_ids(request.query_params.get("receptor_ids"))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        if not all([receptor_ids, st, et]):
+            return JsonResponse(
+                {"error": "Missing required parameters: st, et, receptor_ids"}, status=400
+            )
+        try:
+            st, et = parse_time(st), parse_time(et)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        columns = ["total", "max_value", "cell_count", "centroid_lng", "centroid_lat"]
+        rows = (
+            FootprintCatalog.objects.filter(
+                receptor_id__in=receptor_ids,
+                valid_time__gte=st,
+                valid_time__lt=et,
+            )
+            .order_by("receptor_id", "valid_time")
+            .values_list("receptor_id", "valid_time", *columns)
+        )
+        series = {
+            i: {"receptor_id": i, "times": [], **{c: [] for c in columns}} for i in receptor_ids
+        }
+        for receptor_id, valid_time, *values in rows:
+            item = series[receptor_id]
+            item["times"].append(valid_time.strftime("%Y%m%d%H%M"))
+            for column, value in zip(columns, values):
+                item[column].append(value)
+        return JsonResponse({"receptors": list(series.values())})
+
+
 """
 --- Example: Import Receptor or PollutantSource ---
 
@@ -237,6 +623,46 @@ class ReceptorViewSet(viewsets.ModelViewSet):
 """
 
 
+def footprint_tile_view(request, receptor_id, time, z, x, y):
+    """
+    Web mercator XYZ tile (256 x 256 png) of a receptor footprint
+    time: YYYYMMDDHHmm
+    """
+    if not 0 <= x < 2**z or not 0 <= y < 2**z:
+        return JsonResponse({"error": "Invalid tile coordinates"}, status=400)
+    try:
+        receptor = Receptor.objects.get(id=receptor_id)
+    except Receptor.DoesNotExist:
+        return JsonResponse({"error": "Receptor not found"}, status=404)
+    height = int(receptor.height)
+    try:
+        valid_time = parse_time(time)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        entry = FootprintCatalog.objects.filter(receptor=receptor, valid_time=valid_time).first()
+        file = footprint_file(receptor, time, entry)
+    except FileNotFoundError as e:
+        return JsonResponse({"error": str(e)}, status=404)
+    validators = utils_http.file_validators([file], utils_netcdf.hour_end(time), z, x, y)
+    response = utils_http.not_modified(request, validators)
+    if response:
+        return response
+    try:
+        cache_file = utils_tiles.tile_cache_file(
+            utils_netcdf.get_stilt_receptor_key(receptor.longitude, receptor.latitude, height),
+            valid_time.format("YYYYMMDDHHmm"),
+            z,
+            x,
+            y,
+        )
+        content = utils_tiles.get_tile(file, cache_file, z, x, y)
+        response = HttpResponse(content, content_type="image/png")
+        return utils_http.set_cache_headers(response, validators)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
 @csrf_exempt
 def tool_page_view(request):
     if request.method == "POST":
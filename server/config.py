@@ -3,6 +3,10 @@ import os
 import pendulum
 
 BASE_PATH = os.environ.get("BASE_PATH", "/home/wrf_model")
+# 任务访问的接口地址 (模型配置, 受体, 足迹索引)
+API_BASE_URL = os.environ.get("API_BASE_URL", "http://127.0.0.1:8000").rstrip("/")
+# celery broker
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
 WRF_WD = BASE_PATH + "/wrf"
 DATA_PATH = BASE_PATH + "/data"
 
@@ -33,6 +37,47 @@ WRFOUT_DATA_PATH = DATA_PATH + "/wrfout_data"
 STILT_WD = os.environ.get("STILT_WD", "/home/wrf_model/stilt/jinan_stilt")
 # stilt 输出文件路径
 STILT_DATA_PATH = DATA_PATH + "/stiltout_data"
+# stilt 输出文件格式 npz(稀疏二进制) / json
+STILT_DATA_FORMAT = os.environ.get("STILT_DATA_FORMAT", "npz")
+# stilt npz 足迹值编码 float / log16(log10 量化为16位整数), log16 编码时丢弃低于下限的网格
+# log16 每个网格 6 字节 (float 为 8 字节), 实测同样网格的文件约小 1.3 倍, 读取时需要解码不能内存映射
+STILT_DATA_ENCODING = os.environ.get("STILT_DATA_ENCODING", "float")
+STILT_FOOT_FLOOR = float(os.environ.get("STILT_FOOT_FLOOR", 1e-6))
+# stilt npz 足迹金字塔层数, 生成 2x 4x 8x ... 聚合的低分辨率足迹
+STILT_PYRAMID_LEVELS = int(os.environ.get("STILT_PYRAMID_LEVELS", 4))
+# stilt 输出转换清单路径, 每个受体一个文件
+STILT_MANIFEST_PATH = STILT_DATA_PATH + "/manifest"
+# stilt 结果转换的并行进程数, 0 表示使用 n_cores
+STILT_POSTPROCESS_WORKERS = int(os.environ.get("STILT_POSTPROCESS_WORKERS", 0))
+# stilt 批量模式: 同一区域的受体在一次 STILT 调用中计算
+STILT_BATCH_RUN = os.environ.get("STILT_BATCH_RUN", "true").lower() == "true"
+# stilt 作业目录, 每个作业在独立的目录中运行, 保留 STILT_JOB_RETENTION_DAYS 天
+STILT_JOBS_PATH = os.environ.get("STILT_JOBS_PATH", STILT_WD + "/jobs")
+STILT_JOB_RETENTION_DAYS = int(os.environ.get("STILT_JOB_RETENTION_DAYS", 3))
+# 同时运行的 stilt 作业数
+STILT_PARALLEL_JOBS = int(os.environ.get("STILT_PARALLEL_JOBS", 1))
+# 常驻 R 进程数, 大于 0 时 stilt 作业提交到加载了 STILT 的常驻 R 进程执行, 0 时每个作业启动 Rscript
+STILT_R_WORKERS = int(os.environ.get("STILT_R_WORKERS", 0))
+# stilt 作业分发为 celery 子任务 (stilt 队列), 需要运行 stilt 队列的 worker;
+# 其他节点上的 worker 需设置 API_BASE_URL 和 CELERY_BROKER_URL 指向主节点
+STILT_FANOUT = os.environ.get("STILT_FANOUT", "false").lower() == "true"
+# stilt 受体足迹时间立方体路径
+STILT_CUBE_PATH = DATA_PATH + "/stiltcube_data"
+# stilt 受体足迹日 / 周 / 月聚合路径
+STILT_ROLLUP_PATH = DATA_PATH + "/stiltrollup_data"
+# stilt 足迹瓦片缓存路径
+STILT_TILE_CACHE_PATH = DATA_PATH + "/stilttile_cache"
+STILT_TILE_CACHE_RETENTION_DAYS = int(os.environ.get("STILT_TILE_CACHE_RETENTION_DAYS", 7))
+# stilt 接口 HTTP 缓存: 结束时间早于 STILT_HTTP_RECENT_HOURS 小时的历史数据缓存 STILT_HTTP_MAX_AGE 秒
+STILT_HTTP_RECENT_HOURS = int(os.environ.get("STILT_HTTP_RECENT_HOURS", 24))
+STILT_HTTP_MAX_AGE = int(os.environ.get("STILT_HTTP_MAX_AGE", 30 * 24 * 3600))
+# stilt 足迹合并结果缓存, 使用与 celery broker 不同的 redis db
+STILT_CACHE_REDIS_URL = os.environ.get("STILT_CACHE_REDIS_URL", "redis://127.0.0.1:6379/1")
+# 缓存容量(字节), 超过时淘汰最久未访问的结果
+STILT_CACHE_MAX_BYTES = int(os.environ.get("STILT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+# 多受体足迹接口: 单次请求的受体数上限, 并行读取的线程数
+STILT_BATCH_MAX_RECEPTORS = int(os.environ.get("STILT_BATCH_MAX_RECEPTORS", 100))
+STILT_BATCH_WORKERS = int(os.environ.get("STILT_BATCH_WORKERS", 8))
 
 # aermod
 AERMOD_WD = BASE_PATH + "/aermod"
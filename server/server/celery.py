@@ -1,5 +1,6 @@
 import os
 
+import config
 from celery import Celery
 from celery.schedules import crontab
 from kombu import Exchange, Queue
@@ -12,7 +13,7 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 
 app.conf.update(
     worker_name="wrf_stilt_worker",
-    broker_url="redis://127.0.0.1:6379/0",
+    broker_url=config.CELERY_BROKER_URL,
     result_expires=3600 * 24 * 30,  # 30天
     worker_concurrency=1,
     beat_scheduler="django_celery_beat.schedulers:DatabaseScheduler",
@@ -29,12 +30,21 @@ app.conf.update(
     task_queues=(
         Queue("default", Exchange("default"), routing_key="default"),
         Queue("wrf_stilt", Exchange("wrf_stilt"), routing_key="wrf_stilt"),
+        Queue("stilt", Exchange("stilt"), routing_key="stilt"),
     ),
     task_routes={
         "wrf_stilt_task": {
             "queue": "wrf_stilt",
             "routing_key": "wrf_stilt",
         },
+        "stilt_job_task": {
+            "queue": "stilt",
+            "routing_key": "stilt",
+        },
+        "stilt_cycle_callback": {
+            "queue": "stilt",
+            "routing_key": "stilt",
+        },
     },
 )
 
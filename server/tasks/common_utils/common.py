@@ -48,19 +48,29 @@ def render_template(template_file: str, data: dict) -> str:
         return template.render(data)
 
 
+def get_stilt_receptor_key(longitude, latitude, zagl):
+    """Generate STILT receptor key, e.g. 117.1914_36.9719_2"""
+    longitude = int(longitude) if int(longitude) == longitude else longitude
+    latitude = int(latitude) if int(latitude) == latitude else latitude
+    return f"{longitude}_{latitude}_{zagl}"
+
+
 def get_stilt_job_id(time: pendulum.DateTime, longitude, latitude, zagl):
     """Generate STILT job ID."""
     # /home/wrf_model/data/stilt_data/20240418/202404182100_117.1914_36.9719_2_foot.nc"""
-    longitude = int(longitude) if int(longitude) == longitude else longitude
-    latitude = int(latitude) if int(latitude) == latitude else latitude
-    job_id = time.format("YYYYMMDDHH00") + f"_{longitude}_{latitude}_{zagl}"
+    job_id = time.format("YYYYMMDDHH00") + "_" + get_stilt_receptor_key(longitude, latitude, zagl)
     return job_id
 
 
+def get_stilt_cube_file(receptor_key: str, cube_path: str) -> Path:
+    """Get the footprint cube file of a receptor."""
+    return Path(cube_path, f"{receptor_key}_foot.nc")
+
+
 def get_stilt_out_filename(namelist: Namelist, stilt_wd: str):
-    """Get STILT output filenames."""
+    """Get STILT output filenames, run_stilt.r runs every hour from t_start to t_end inclusive."""
     file_list = []
-    for hour_delta in range(int((namelist.t_end - namelist.t_start).total_hours())):
+    for hour_delta in range(int((namelist.t_end - namelist.t_start).total_hours()) + 1):
         time = namelist.t_start.add(hours=hour_delta)
         job_id = get_stilt_job_id(
             time=time, longitude=namelist.long, latitude=namelist.lati, zagl=namelist.zagl
@@ -0,0 +1,65 @@
+"""
+STILT 输出转换清单
+
+每个受体一个 json 文件, 按 job_id 记录已转换的 nc 文件的 size / mtime / sha1 和输出文件,
+源文件未变化且输出文件存在时跳过转换。
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from loguru import logger
+
+
+def file_sha1(filename: Path) -> str:
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class ConversionManifest:
+    def __init__(self, manifest_file: Path):
+        self.manifest_file = Path(manifest_file)
+        self.entries = {}
+        if self.manifest_file.is_file():
+            try:
+                with open(self.manifest_file, "r") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.warning(f"Read manifest {self.manifest_file} failed: {e}")
+
+    def is_converted(self, nc_file: Path, out_file: Path) -> bool:
+        """nc 文件的 size 和 mtime 未变化, 或内容 hash 未变化, 且输出文件存在"""
+        entry = self.entries.get(nc_file.parent.name)
+        if entry is None or entry["target"] != str(out_file) or not Path(out_file).is_file():
+            return False
+        stat = nc_file.stat()
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        # 重新生成但内容相同
+        if file_sha1(nc_file) == entry["sha1"]:
+            entry["mtime_ns"] = stat.st_mtime_ns
+            return True
+        return False
+
+    def update(self, nc_file: Path, out_file: Path):
+        stat = nc_file.stat()
+        self.entries[nc_file.parent.name] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha1": file_sha1(nc_file),
+            "target": str(out_file),
+        }
+
+    def save(self):
+        self.manifest_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_name(self.manifest_file.name + ".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_file, self.manifest_file)
@@ -0,0 +1,138 @@
+"""
+足迹合并结果缓存
+
+多个 web 进程共享的 Redis 缓存, 使用与 celery broker 不同的 db, 容量按字节数限制:
+    {prefix}:item:{key}          hash, body / content_type
+    {prefix}:lru                 zset, key -> 最近访问时间
+    {prefix}:size                hash, key -> 字节数
+    {prefix}:bytes               缓存总字节数
+    {prefix}:receptor:{rk}       set, 受体的缓存 key, run_stilt 写入新的足迹时按小时失效
+
+超过容量时淘汰最久未访问的结果。Redis 不可用时只记录日志, 不影响接口。
+"""
+
+import time
+import typing
+
+import pendulum
+import redis
+from loguru import logger
+
+
+class FootprintCache:
+    def __init__(self, url: str, max_bytes: int, prefix: str = "stilt:merge"):
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+
+    @staticmethod
+    def make_key(
+        receptor_key: str,
+        st: pendulum.DateTime,
+        et: pendulum.DateTime,
+        resp_type: str,
+        layer,
+        filters: str = "",
+    ) -> str:
+        """
+        缓存 key: 受体|开始时间|结束时间|返回类型|时间层|筛选参数
+        时间保留到分钟, 同一小时内不同的 st / et 读取的小时可能不同, 不能共用结果
+        """
+        return "|".join([
+            receptor_key,
+            st.format("YYYYMMDDHHmm"),
+            et.format("YYYYMMDDHHmm"),
+            resp_type,
+            str(layer),
+            filters,
+        ])
+
+    def _item(self, key: str) -> str:
+        return f"{self.prefix}:item:{key}"
+
+    def _receptor(self, receptor_key: str) -> str:
+        return f"{self.prefix}:receptor:{receptor_key}"
+
+    def get(self, key: str) -> typing.Optional[typing.Tuple[bytes, str]]:
+        """返回 (body, content_type), 未命中返回 None"""
+        try:
+            item = self.client.hgetall(self._item(key))
+            if not item:
+                return None
+            self.client.zadd(f"{self.prefix}:lru", {key: time.time()}, xx=True)
+            return item[b"body"], item[b"content_type"].decode()
+        except redis.RedisError as e:
+            logger.warning(f"footprint cache get failed: {e}")
+            return None
+
+    def set(self, key: str, body: bytes, content_type: str):
+        """
+        写入结果, 已缓存的 key 只更新访问时间;
+        与 :size 在同一事务 (WATCH) 中检查和写入, 多个进程同时写入同一 key 时只计数一次
+        """
+        receptor_key = key.split("|", 1)[0]
+        size_key = f"{self.prefix}:size"
+
+        def write(pipe):
+            exists = pipe.hexists(size_key, key)
+            pipe.multi()
+            pipe.zadd(f"{self.prefix}:lru", {key: time.time()})
+            if exists:
+                return
+            pipe.hset(self._item(key), mapping={"body": body, "content_type": content_type})
+            pipe.hset(size_key, key, len(body))
+            pipe.sadd(self._receptor(receptor_key), key)
+            pipe.incrby(f"{self.prefix}:bytes", len(body))
+
+        try:
+            self.client.transaction(write, size_key)
+            self._evict()
+        except redis.RedisError as e:
+            logger.warning(f"footprint cache set failed: {e}")
+
+    def _delete(self, keys: typing.List[str]):
+        if not keys:
+            return
+        size_key = f"{self.prefix}:size"
+
+        def delete(pipe):
+            sizes = pipe.hmget(size_key, keys)
+            pipe.multi()
+            for key in keys:
+                pipe.delete(self._item(key))
+                pipe.srem(self._receptor(key.split("|", 1)[0]), key)
+            pipe.zrem(f"{self.prefix}:lru", *keys)
+            pipe.hdel(size_key, *keys)
+            # 只减去仍在缓存中的 key, 其他进程已删除的不重复计数
+            pipe.decrby(f"{self.prefix}:bytes", sum(int(size) for size in sizes if size))
+
+        self.client.transaction(delete, size_key)
+
+    def _evict(self):
+        """淘汰最久未访问的结果, 直到总字节数不超过容量"""
+        while int(self.client.get(f"{self.prefix}:bytes") or 0) > self.max_bytes:
+            oldest = self.client.zpopmin(f"{self.prefix}:lru")
+            if not oldest:
+                # 计数与缓存内容不一致, 重置
+                self.client.set(f"{self.prefix}:bytes", 0)
+                break
+            self._delete([key.decode() for key, _ in oldest])
+
+    def invalidate(self, receptor_key: str, times: typing.Iterable[pendulum.DateTime]):
+        """删除受体时间范围覆盖任一小时的缓存结果"""
+        hours = [t.format("YYYYMMDDHH") for t in times]
+        if not hours:
+            return
+        try:
+            keys = [key.decode() for key in self.client.smembers(self._receptor(receptor_key))]
+            # 时间格式等长, 按小时前缀比较; st / et 所在的小时都视为覆盖, 宁可多删
+            stale = [
+                key
+                for key in keys
+                if any(key.split("|")[1][:10] <= hour <= key.split("|")[2][:10] for hour in hours)
+            ]
+            self._delete(stale)
+            if stale:
+                logger.info(f"invalidate {len(stale)} cached footprint merges of {receptor_key}")
+        except redis.RedisError as e:
+            logger.warning(f"footprint cache invalidate failed: {e}")
@@ -0,0 +1,136 @@
+"""
+受体足迹时间立方体
+
+每个受体一个只追加的 NetCDF4(HDF5) 文件, 按时间记录保存稀疏网格:
+    lon(lon), lat(lat)               网格轴, 只保存一次
+    time(record)                     记录时间, hours since 1970-01-01 00:00:00 UTC
+    cell_start(record)               记录在 cell 维上的起始位置
+    cell_count(record)               记录的网格数
+    cell_idx(cell), cell_val(cell)   有效网格的扁平索引和足迹值
+
+足迹的多个时间层合并后写入, 同一小时重复写入时追加新记录, 读取时以最后一条为准。
+时间段查询按记录分段读取连续的 cell 数据 (间隔不超过 CELL_GAP_SIZE 的段合并读取),
+重新写入的旧小时不会使读取范围扩大到中间的所有记录, 再用 np.bincount 求和与计数。
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pendulum
+from loguru import logger
+from netCDF4 import Dataset
+
+from .footprint_store import Footprint, FootprintSum
+
+# cell 维的分块大小, 约为一天的有效网格数
+CELL_CHUNK_SIZE = 1 << 20
+# 读取时合并间隔不超过该网格数的记录段
+CELL_GAP_SIZE = 1 << 16
+EPOCH = pendulum.datetime(1970, 1, 1, tz="UTC")
+
+
+def to_hours(time: pendulum.DateTime) -> int:
+    """时间转为 hours since 1970-01-01"""
+    return int((time - EPOCH).total_hours())
+
+
+def from_hours(hours: int) -> pendulum.DateTime:
+    return EPOCH.add(hours=int(hours))
+
+
+def _create_cube(cube_file: Path, footprint: Footprint) -> Dataset:
+    fh = Dataset(cube_file, mode="w", format="NETCDF4")
+    fh.createDimension("lon", footprint.nx)
+    fh.createDimension("lat", footprint.ny)
+    fh.createDimension("record", None)
+    fh.createDimension("cell", None)
+    fh.createVariable("lon", "f8", ("lon",))[:] = footprint.lon
+    fh.createVariable("lat", "f8", ("lat",))[:] = footprint.lat
+    time = fh.createVariable("time", "i8", ("record",), chunksizes=(1024,))
+    time.units = "hours since 1970-01-01 00:00:00"
+    fh.createVariable("cell_start", "i8", ("record",), chunksizes=(1024,))
+    fh.createVariable("cell_count", "i8", ("record",), chunksizes=(1024,))
+    fh.createVariable("cell_idx", footprint.idx.dtype, ("cell",), chunksizes=(CELL_CHUNK_SIZE,))
+    fh.createVariable("cell_val", footprint.val.dtype, ("cell",), chunksizes=(CELL_CHUNK_SIZE,))
+    return fh
+
+
+def _same_grid(fh: Dataset, footprint: Footprint) -> bool:
+    lon, lat = fh.variables["lon"][:], fh.variables["lat"][:]
+    return (
+        lon.shape == footprint.lon.shape
+        and lat.shape == footprint.lat.shape
+        and np.allclose(lon, footprint.lon)
+        and np.allclose(lat, footprint.lat)
+    )
+
+
+def append_footprint(cube_file: Path, time: pendulum.DateTime, footprint: Footprint):
+    """追加一个小时的足迹, 网格变化时备份旧文件并新建"""
+    cube_file = Path(cube_file)
+    footprint = footprint.sum_layers()
+    fh = None
+    if cube_file.is_file():
+        fh = Dataset(cube_file, mode="a")
+        fh.set_auto_mask(False)
+        if not _same_grid(fh, footprint):
+            fh.close()
+            fh = None
+            logger.warning(f"footprint grid changed, backup cube: {cube_file}")
+            cube_file.rename(str(cube_file) + ".old")
+    if fh is None:
+        fh = _create_cube(cube_file, footprint)
+
+    with fh:
+        record = fh.dimensions["record"].size
+        start = fh.dimensions["cell"].size
+        count = footprint.idx.size
+        fh.variables["cell_idx"][start : start + count] = footprint.idx
+        fh.variables["cell_val"][start : start + count] = footprint.val
+        fh.variables["time"][record] = to_hours(time)
+        fh.variables["cell_start"][record] = start
+        fh.variables["cell_count"][record] = count
+
+
+def read_range(cube_file: Path, st: pendulum.DateTime, et: pendulum.DateTime):
+    """
+    读取 [st, et) 内各小时足迹的逐网格求和与计数
+
+    返回 (FootprintSum, hours), hours 为立方体中存在的小时 (hours since 1970)
+    """
+    with Dataset(cube_file, mode="r") as fh:
+        fh.set_auto_mask(False)
+        lon = fh.variables["lon"][:]
+        lat = fh.variables["lat"][:]
+        times = fh.variables["time"][:]
+        starts = fh.variables["cell_start"][:]
+        counts = fh.variables["cell_count"][:]
+
+        # 同一小时取最后写入的记录
+        in_range = np.flatnonzero((times >= to_hours(st)) & (times < to_hours(et)))
+        _, last = np.unique(times[in_range][::-1], return_index=True)
+        records = np.sort(in_range[::-1][last])
+        if records.size == 0:
+            empty = np.array([], dtype=np.int64)
+            return FootprintSum(lon=lon, lat=lat, idx=empty, sum=np.array([]), count=empty), empty
+
+        # 按记录分段读取连续的 cell, 间隔较小的段合并读取后剔除中间的无关记录
+        ends = starts[records] + counts[records]
+        breaks = np.flatnonzero(starts[records[1:]] - ends[:-1] > CELL_GAP_SIZE) + 1
+        idx_parts, val_parts = [], []
+        for group in np.split(records, breaks):
+            rec_lo, rec_hi = group[0], group[-1]
+            cell_lo, cell_hi = starts[rec_lo], starts[rec_hi] + counts[rec_hi]
+            keep = np.zeros(rec_hi - rec_lo + 1, dtype=bool)
+            keep[group - rec_lo] = True
+            mask = np.repeat(keep, counts[rec_lo : rec_hi + 1])
+            idx_parts.append(fh.variables["cell_idx"][cell_lo:cell_hi][mask])
+            val_parts.append(fh.variables["cell_val"][cell_lo:cell_hi][mask])
+        idx, val = np.concatenate(idx_parts), np.concatenate(val_parts)
+
+    size = lon.size * lat.size
+    sums = np.bincount(idx, weights=val, minlength=size)
+    cell_counts = np.bincount(idx, minlength=size)
+    cells = np.flatnonzero(cell_counts)
+    fsum = FootprintSum(lon=lon, lat=lat, idx=cells, sum=sums[cells], count=cell_counts[cells])
+    return fsum, times[records]
@@ -0,0 +1,142 @@
+"""
+受体足迹的日 / 周 / 月聚合
+
+每个聚合保存为一个 .npz 文件, 内容为该时段内逐小时足迹的逐网格求和与计数:
+    {rollup_path}/{receptor_key}/day/20240501.npz
+    {rollup_path}/{receptor_key}/week/20240429.npz    周一开始
+    {rollup_path}/{receptor_key}/month/202405.npz
+    lon, lat, idx, sum, count 同 FootprintSum, hours 为包含的小时 (hours since 1970)
+
+日聚合从足迹时间立方体读取, 周和月聚合由日聚合相加。
+任意时间段按 月 > 周 > 日 的顺序取完整对齐的聚合, 剩余的小时再单独读取。
+"""
+
+import os
+import typing
+from pathlib import Path
+
+import numpy as np
+import pendulum
+from loguru import logger
+
+from . import footprint_cube
+from .footprint_store import FootprintSum, load_npz, sum_footprints
+
+# 聚合周期, 按从大到小的顺序取用
+ROLLUP_PERIODS = ("month", "week", "day")
+
+
+def period_start(time: pendulum.DateTime, period: str) -> pendulum.DateTime:
+    return time.start_of(period)
+
+
+def period_end(start: pendulum.DateTime, period: str) -> pendulum.DateTime:
+    return start.add(**{f"{period}s": 1})
+
+
+def rollup_file(rollup_dir: Path, period: str, start: pendulum.DateTime) -> Path:
+    name = start.format("YYYYMM") if period == "month" else start.format("YYYYMMDD")
+    return Path(rollup_dir, period, f"{name}.npz")
+
+
+def save_rollup(filename: Path, fsum: FootprintSum, hours: np.ndarray):
+    """写入聚合文件, 先写临时文件再替换"""
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    tmp_name = filename.with_name(filename.name + ".tmp")
+    with open(tmp_name, "wb") as f:
+        np.savez(
+            f,
+            lon=fsum.lon,
+            lat=fsum.lat,
+            idx=fsum.idx,
+            sum=fsum.sum,
+            count=fsum.count,
+            hours=np.asarray(hours, dtype=np.int64),
+        )
+    os.replace(tmp_name, filename)
+
+
+def load_rollup(filename: Path) -> typing.Tuple[FootprintSum, np.ndarray]:
+    npz = load_npz(filename)
+    fsum = FootprintSum(
+        lon=npz["lon"], lat=npz["lat"], idx=npz["idx"], sum=npz["sum"], count=npz["count"]
+    )
+    return fsum, npz["hours"]
+
+
+def _build_day(cube_file: Path, rollup_dir: Path, start: pendulum.DateTime):
+    fsum, hours = footprint_cube.read_range(cube_file, start, period_end(start, "day"))
+    filename = rollup_file(rollup_dir, "day", start)
+    if hours.size == 0:
+        filename.unlink(missing_ok=True)
+        return
+    save_rollup(filename, fsum, hours)
+
+
+def _build_from_days(rollup_dir: Path, period: str, start: pendulum.DateTime):
+    """由日聚合相加得到周或月聚合"""
+    parts, hours = [], []
+    day, end = start, period_end(start, period)
+    while day < end:
+        day_file = rollup_file(rollup_dir, "day", day)
+        if day_file.is_file():
+            fsum, day_hours = load_rollup(day_file)
+            parts.append(fsum)
+            hours.append(day_hours)
+        day = day.add(days=1)
+    filename = rollup_file(rollup_dir, period, start)
+    if not parts:
+        filename.unlink(missing_ok=True)
+        return
+    save_rollup(filename, sum_footprints(parts), np.concatenate(hours))
+
+
+def update_rollups(cube_file: Path, rollup_dir: Path, times: typing.Iterable[pendulum.DateTime]):
+    """重新计算包含 times 中任一小时的日 / 周 / 月聚合"""
+    days = sorted({period_start(t, "day") for t in times})
+    for day in days:
+        _build_day(cube_file, rollup_dir, day)
+    for period in ("week", "month"):
+        for start in sorted({period_start(day, period) for day in days}):
+            _build_from_days(rollup_dir, period, start)
+    if days:
+        logger.info(f"update rollups of {rollup_dir.name}: {days[0]} ~ {days[-1]}")
+
+
+def read_rollups(
+    rollup_dir: Path, st: pendulum.DateTime, et: pendulum.DateTime
+) -> typing.Tuple[list, list]:
+    """
+    用完整对齐的聚合覆盖 [st, et), 优先使用较长的周期
+    返回 ([(FootprintSum, hours), ...], 聚合未覆盖的时间段 [(start, end), ...])
+    聚合中缺失的小时不在聚合内, 由调用方按逐小时文件处理
+    """
+    parts, gaps = [], []
+    cursor, gap_start = st, None
+    while cursor < et:
+        for period in ROLLUP_PERIODS:
+            end = period_end(cursor, period)
+            if period_start(cursor, period) != cursor or end > et:
+                continue
+            filename = rollup_file(rollup_dir, period, cursor)
+            if not filename.is_file():
+                continue
+            try:
+                fsum, hours = load_rollup(filename)
+            except Exception as e:
+                logger.error(f"Read rollup {filename} failed: {e}")
+                continue
+            parts.append((fsum, hours))
+            break
+        else:
+            end = cursor.add(hours=1)
+            gap_start = gap_start or cursor
+            cursor = end
+            continue
+        if gap_start:
+            gaps.append((gap_start, cursor))
+            gap_start = None
+        cursor = end
+    if gap_start:
+        gaps.append((gap_start, et))
+    return parts, gaps
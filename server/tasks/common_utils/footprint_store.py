@@ -0,0 +1,420 @@
+"""
+STILT 足迹稀疏存储
+
+每个足迹保存为一个 .npz 文件, 网格定义只保存一次 (经纬度轴), 有效网格保存为扁平索引和值两个数组:
+    lon: 网格经度轴 (nx,)
+    lat: 网格纬度轴 (ny,)
+    idx: 有效网格的扁平索引 lat_index * nx + lng_index
+    val: 有效网格的足迹值
+    t:   有效网格的时间层索引, 仅在足迹有多个时间层时保存
+
+可选 log16 编码: 足迹值取 log10 后量化为 16 位整数, 保存为 val_q, 缩放系数和偏移量保存为
+val_scale / val_offset, 解码 val = 10 ** (val_q * val_scale + val_offset) (float32), 低于下限的网格在写入时丢弃。
+每个网格由 idx(int32) + val(float32) 8 字节减为 6 字节, 同样的网格文件约小 1.3 倍, 其余减少来自丢弃的低值网格;
+val 需要解码, 不能像 float 编码那样内存映射
+"""
+
+import json
+import os
+import struct
+import typing
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+FOOTPRINT_COLUMNS = ["lng", "lat", "val"]
+# 足迹值编码 float: 原始浮点数 / log16: log10 后量化为 16 位整数
+FOOTPRINT_ENCODINGS = ("float", "log16")
+LOG16_LEVELS = np.iinfo(np.uint16).max
+
+
+@dataclass
+class Footprint:
+    lon: np.ndarray
+    lat: np.ndarray
+    idx: np.ndarray
+    val: np.ndarray
+    t: typing.Optional[np.ndarray] = None
+
+    @property
+    def nx(self) -> int:
+        return self.lon.size
+
+    @property
+    def ny(self) -> int:
+        return self.lat.size
+
+    @property
+    def resolution(self) -> float:
+        """网格经度方向的分辨率"""
+        return float(abs(self.lon[1] - self.lon[0])) if self.nx > 1 else 0.0
+
+    @property
+    def lngs(self) -> np.ndarray:
+        """每个有效网格的经度"""
+        return self.lon[self.idx % self.nx]
+
+    @property
+    def lats(self) -> np.ndarray:
+        """每个有效网格的纬度"""
+        return self.lat[self.idx // self.nx]
+
+    def __len__(self):
+        return self.idx.size
+
+    def cells(self) -> np.ndarray:
+        """(N, 3) 的 [lng, lat, val] 数组"""
+        return np.column_stack((self.lngs, self.lats, self.val)).astype(np.float64, copy=False)
+
+    def bounds(self) -> typing.Optional[list]:
+        """[[min_lat, min_lng], [max_lat, max_lng]], 网格轴单调, 由索引范围计算; 没有有效网格时为 None"""
+        if self.idx.size == 0:
+            return None
+        lat_indices = self.idx // self.nx
+        lng_indices = self.idx % self.nx
+        lng_min, lng_max = sorted(self.lon[[lng_indices.min(), lng_indices.max()]])
+        lat_min, lat_max = sorted(self.lat[[lat_indices.min(), lat_indices.max()]])
+        return [[float(lat_min), float(lng_min)], [float(lat_max), float(lng_max)]]
+
+    def centroid(self) -> typing.Optional[typing.Tuple[float, float]]:
+        """按足迹值加权的中心 (lng, lat), 没有有效网格或总和为 0 时为 None"""
+        total = float(self.val.sum())
+        if self.idx.size == 0 or total <= 0:
+            return None
+        return float(self.lngs @ self.val / total), float(self.lats @ self.val / total)
+
+    @property
+    def layers(self) -> int:
+        """时间层数"""
+        return int(self.t.max()) + 1 if self.t is not None and self.t.size else 1
+
+    def sum_layers(self) -> "Footprint":
+        """合并同一网格的多个时间层"""
+        if self.t is None and np.all(self.idx[1:] > self.idx[:-1]):
+            return self
+        idx, inverse = np.unique(self.idx, return_inverse=True)
+        val = np.bincount(inverse, weights=self.val, minlength=idx.size)
+        return Footprint(lon=self.lon, lat=self.lat, idx=idx, val=val)
+
+    def select_layer(self, layer: int) -> "Footprint":
+        """选择单个时间层"""
+        if self.t is None:
+            mask = np.full(self.idx.size, layer == 0)
+        else:
+            mask = self.t == layer
+        return Footprint(lon=self.lon, lat=self.lat, idx=self.idx[mask], val=self.val[mask])
+
+    def filter(
+        self,
+        bbox: typing.Optional[typing.Tuple[float, float, float, float]] = None,
+        min_value: typing.Optional[float] = None,
+        top_n: typing.Optional[int] = None,
+    ) -> "Footprint":
+        """
+        bbox: (min_lng, min_lat, max_lng, max_lat) 内的网格, min_value: 值不小于 min_value 的网格,
+        top_n: 值最大的 n 个网格; 结果保持原有顺序
+        """
+        mask = None
+        if bbox is not None:
+            min_lng, min_lat, max_lng, max_lat = bbox
+            # 先在经纬度轴上判断, 再按索引取值
+            lng_ok = (self.lon >= min_lng) & (self.lon <= max_lng)
+            lat_ok = (self.lat >= min_lat) & (self.lat <= max_lat)
+            mask = lng_ok[self.idx % self.nx] & lat_ok[self.idx // self.nx]
+        if min_value is not None:
+            value_ok = self.val >= min_value
+            mask = value_ok if mask is None else mask & value_ok
+        keep = np.flatnonzero(mask) if mask is not None else None
+        if top_n is not None:
+            candidates = keep if keep is not None else np.arange(self.idx.size)
+            if top_n < candidates.size:
+                top = np.argpartition(self.val[candidates], candidates.size - top_n)
+                keep = np.sort(candidates[top[candidates.size - top_n :]])
+        if keep is None:
+            return self
+        return Footprint(
+            lon=self.lon,
+            lat=self.lat,
+            idx=self.idx[keep],
+            val=self.val[keep],
+            t=self.t[keep] if self.t is not None else None,
+        )
+
+    def coarsen(self, factor: int) -> "Footprint":
+        """
+        按 factor x factor 的块聚合, 合并时间层, 值为块内平均值 (块内无效网格按 0 计)
+        块的经纬度取块内网格中心的平均值, 边缘不完整的块按实际网格数平均
+        """
+        footprint = self.sum_layers()
+        lng_block = np.arange(self.nx) // factor
+        lat_block = np.arange(self.ny) // factor
+        lng_size = np.bincount(lng_block)
+        lat_size = np.bincount(lat_block)
+        lon = np.bincount(lng_block, weights=self.lon) / lng_size
+        lat = np.bincount(lat_block, weights=self.lat) / lat_size
+
+        block_x = lng_block[footprint.idx % self.nx]
+        block_y = lat_block[footprint.idx // self.nx]
+        block = block_y * lon.size + block_x
+        sums = np.bincount(block, weights=footprint.val, minlength=lon.size * lat.size)
+        idx = np.flatnonzero(sums)
+        area = lat_size[idx // lon.size] * lng_size[idx % lon.size]
+        return Footprint(
+            lon=np.round(lon, 6),
+            lat=np.round(lat, 6),
+            idx=idx.astype(index_dtype(lon.size, lat.size)),
+            val=sums[idx] / area,
+        )
+
+    def to_dict(self, with_layers: bool = False) -> dict:
+        """
+        转为接口使用的 {"columns": [...], "data": [[lng, lat, val], ...]} 格式
+        with_layers: 增加时间层列 t
+        """
+        if not with_layers:
+            return {"columns": list(FOOTPRINT_COLUMNS), "data": self.cells().tolist()}
+        t = self.t if self.t is not None else np.zeros(self.idx.size)
+        cells = np.column_stack((self.cells(), t))
+        return {"columns": FOOTPRINT_COLUMNS + ["t"], "data": cells.tolist()}
+
+    @classmethod
+    def from_cells(cls, lngs, lats, vals) -> "Footprint":
+        """由 [lng, lat, val] 列构建, 网格轴取出现过的经纬度"""
+        lon, lng_indices = np.unique(np.asarray(lngs, dtype=np.float64), return_inverse=True)
+        lat, lat_indices = np.unique(np.asarray(lats, dtype=np.float64), return_inverse=True)
+        idx = (lat_indices * lon.size + lng_indices).astype(index_dtype(lon.size, lat.size))
+        return cls(lon=lon, lat=lat, idx=idx, val=np.asarray(vals, dtype=np.float64))
+
+
+@dataclass
+class FootprintSum:
+    """多个小时足迹的逐网格求和与计数, 用于求时段平均"""
+
+    lon: np.ndarray
+    lat: np.ndarray
+    idx: np.ndarray
+    sum: np.ndarray
+    count: np.ndarray
+
+    def mean(self) -> Footprint:
+        return Footprint(lon=self.lon, lat=self.lat, idx=self.idx, val=self.sum / self.count)
+
+    def total(self) -> Footprint:
+        return Footprint(lon=self.lon, lat=self.lat, idx=self.idx, val=self.sum)
+
+    @classmethod
+    def from_footprint(cls, footprint: Footprint) -> "FootprintSum":
+        count = np.ones(footprint.idx.size, dtype=np.int64)
+        return cls(footprint.lon, footprint.lat, footprint.idx, footprint.val, count)
+
+
+def sum_footprints(parts: typing.List[FootprintSum]) -> FootprintSum:
+    """按经纬度合并多个 FootprintSum, 网格轴取出现过的经纬度"""
+    if not parts:
+        empty = np.array([], dtype=np.int64)
+        return FootprintSum(lon=empty, lat=empty, idx=empty, sum=np.array([]), count=empty)
+    if len(parts) == 1:
+        return parts[0]
+    lngs = np.concatenate([p.lon[p.idx % p.lon.size] for p in parts])
+    lats = np.concatenate([p.lat[p.idx // p.lon.size] for p in parts])
+    lon, lng_indices = np.unique(lngs, return_inverse=True)
+    lat, lat_indices = np.unique(lats, return_inverse=True)
+    idx, inverse = np.unique(lat_indices * lon.size + lng_indices, return_inverse=True)
+    sums = np.bincount(inverse, weights=np.concatenate([p.sum for p in parts]))
+    counts = np.bincount(inverse, weights=np.concatenate([p.count for p in parts]))
+    return FootprintSum(lon=lon, lat=lat, idx=idx, sum=sums, count=counts.astype(np.int64))
+
+
+class GridAccumulator:
+    """
+    在区域网格 (xmn, xmx, ymn, ymx, xres, yres) 上累加多个足迹的逐网格求和与计数
+    各足迹的网格直接映射为区域网格的整数索引, 区域外的网格丢弃
+    和与计数保存在预分配的二维数组中, 数组只覆盖出现过有效网格的矩形窗口, 需要时扩展
+    """
+
+    def __init__(self, xmn: float, xmx: float, ymn: float, ymx: float, xres: float, yres: float):
+        self.xmn, self.ymn, self.xres, self.yres = xmn, ymn, xres, yres
+        nx = int(np.ceil((xmx - xmn) / xres - 1e-6))
+        ny = int(np.ceil((ymx - ymn) / yres - 1e-6))
+        self.lon = np.round(xmn + (np.arange(nx) + 0.5) * xres, 6)
+        self.lat = np.round(ymn + (np.arange(ny) + 0.5) * yres, 6)
+        # 窗口左下角在区域网格中的位置
+        self.x0 = self.y0 = 0
+        self.sum = np.zeros((0, 0))
+        self.count = np.zeros((0, 0), dtype=np.int64)
+
+    @staticmethod
+    def _axis_index(axis: np.ndarray, start: float, res: float, size: int) -> np.ndarray:
+        index = np.floor((axis - start) / res).astype(np.int64)
+        index[(index < 0) | (index >= size)] = -1
+        return index
+
+    def _grow(self, x0: int, x1: int, y0: int, y1: int):
+        """扩展窗口以覆盖 [x0, x1) x [y0, y1)"""
+        height, width = self.sum.shape
+        if width:
+            if x0 >= self.x0 and y0 >= self.y0 and x1 <= self.x0 + width and y1 <= self.y0 + height:
+                return
+            x0, y0 = min(x0, self.x0), min(y0, self.y0)
+            x1, y1 = max(x1, self.x0 + width), max(y1, self.y0 + height)
+        sums = np.zeros((y1 - y0, x1 - x0))
+        counts = np.zeros((y1 - y0, x1 - x0), dtype=np.int64)
+        oy, ox = self.y0 - y0, self.x0 - x0
+        sums[oy : oy + height, ox : ox + width] = self.sum
+        counts[oy : oy + height, ox : ox + width] = self.count
+        self.x0, self.y0, self.sum, self.count = x0, y0, sums, counts
+
+    def add(self, part: FootprintSum):
+        # 先映射网格轴, 再按扁平索引取值, 逐网格只有整数运算
+        lng_map = self._axis_index(part.lon, self.xmn, self.xres, self.lon.size)
+        lat_map = self._axis_index(part.lat, self.ymn, self.yres, self.lat.size)
+        ix = lng_map[part.idx % part.lon.size]
+        iy = lat_map[part.idx // part.lon.size]
+        sums, counts = part.sum, part.count
+        inside = (ix >= 0) & (iy >= 0)
+        if not inside.all():
+            ix, iy, sums, counts = ix[inside], iy[inside], sums[inside], counts[inside]
+        if ix.size == 0:
+            return
+        # 输出使用足迹文件中的经纬度
+        self.lon[lng_map[lng_map >= 0]] = part.lon[lng_map >= 0]
+        self.lat[lat_map[lat_map >= 0]] = part.lat[lat_map >= 0]
+
+        self._grow(ix.min(), ix.max() + 1, iy.min(), iy.max() + 1)
+        height, width = self.sum.shape
+        local = (iy - self.y0) * width + (ix - self.x0)
+        self.sum += np.bincount(local, weights=sums, minlength=self.sum.size).reshape(height, width)
+        self.count += (
+            np.bincount(local, weights=counts, minlength=self.count.size)
+            .reshape(height, width)
+            .astype(np.int64)
+        )
+
+    def result(self) -> FootprintSum:
+        rows, cols = np.nonzero(self.count)
+        idx = (rows + self.y0) * self.lon.size + cols + self.x0
+        return FootprintSum(
+            lon=self.lon,
+            lat=self.lat,
+            idx=idx,
+            sum=self.sum[rows, cols],
+            count=self.count[rows, cols],
+        )
+
+
+def pyramid_file(filename: Path, level: int) -> Path:
+    """金字塔第 level 层 (2 ** level 倍聚合) 的文件路径, 第 0 层为原始足迹"""
+    filename = Path(filename)
+    if level == 0:
+        return filename
+    return filename.with_name(f"{filename.stem}_x{2 ** level}{filename.suffix}")
+
+
+def index_dtype(nx: int, ny: int):
+    """扁平索引使用的整数类型"""
+    return np.int32 if nx * ny < np.iinfo(np.int32).max else np.int64
+
+
+def encode_log16(val: np.ndarray, floor: float):
+    """log10 量化为 uint16, 返回 (val_q, scale, offset)"""
+    log_val = np.log10(val)
+    offset = max(float(np.log10(floor)), float(log_val.min())) if val.size else 0.0
+    scale = (float(log_val.max()) - offset) / LOG16_LEVELS if val.size else 0.0
+    scale = scale or 1.0
+    val_q = np.rint((log_val - offset) / scale).astype(np.uint16)
+    return val_q, scale, offset
+
+
+def decode_log16(val_q: np.ndarray, scale: float, offset: float) -> np.ndarray:
+    """解码为 float32, 与 float 编码的足迹值类型一致, 量化误差远大于 float32 的精度"""
+    log_val = val_q.astype(np.float32)
+    log_val *= np.float32(scale)
+    log_val += np.float32(offset)
+    return np.power(np.float32(10.0), log_val, dtype=np.float32)
+
+
+def save_footprint(
+    filename: Path, footprint: Footprint, encoding: str = "float", floor: float = 0.0
+) -> Path:
+    """
+    写入 .npz, 先写临时文件再替换, 避免接口读到写了一半的文件
+    encoding: float / log16, floor: 低于该值的网格不写入
+    """
+    if encoding not in FOOTPRINT_ENCODINGS:
+        raise ValueError(f"Unknown footprint encoding: {encoding}")
+    filename = Path(filename)
+    tmp_name = filename.with_name(filename.name + ".tmp")
+    mask = footprint.val >= floor
+    if encoding == "log16":
+        # log10 编码要求值为正
+        mask &= footprint.val > 0
+    arrays = dict(lon=footprint.lon, lat=footprint.lat, idx=footprint.idx[mask])
+    if encoding == "log16":
+        arrays["val_q"], arrays["val_scale"], arrays["val_offset"] = encode_log16(
+            footprint.val[mask], floor=floor or float(footprint.val[mask].min(initial=1.0))
+        )
+    else:
+        arrays["val"] = footprint.val[mask]
+    if footprint.t is not None:
+        arrays["t"] = footprint.t[mask]
+    # 不压缩, 读取时可以直接内存映射
+    with open(tmp_name, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_name, filename)
+    return filename
+
+
+def load_npz(filename: Path) -> typing.Dict[str, np.ndarray]:
+    """
+    读取 .npz, 未压缩的数组直接内存映射 (np.load 不支持 npz 的 mmap_mode)
+    多个进程读取同一文件时共享系统页缓存, 不需要解析和拷贝
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, "rb") as fp:
+        for info in zf.infolist():
+            name = info.filename[: -len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as f:
+                    arrays[name] = np.lib.format.read_array(f)
+                continue
+            # 跳过 local file header, 读取 .npy 头
+            fp.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", fp.read(4))
+            fp.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+            if not shape or 0 in shape:
+                arrays[name] = np.fromfile(fp, dtype=dtype, count=int(np.prod(shape))).reshape(
+                    shape
+                )
+                continue
+            arrays[name] = np.memmap(
+                filename,
+                dtype=dtype,
+                mode="r",
+                offset=fp.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load_footprint(filename: Path) -> Footprint:
+    """读取足迹, 兼容 .npz 和旧的 .json 文件"""
+    filename = Path(filename)
+    if filename.suffix == ".json":
+        with open(filename, "r") as f:
+            data = np.asarray(json.load(f)["data"], dtype=np.float64).reshape(-1, 3)
+        return Footprint.from_cells(data[:, 0], data[:, 1], data[:, 2])
+
+    npz = load_npz(filename)
+    if "val_q" in npz:
+        val = decode_log16(npz["val_q"], float(npz["val_scale"]), float(npz["val_offset"]))
+    else:
+        val = npz["val"]
+    return Footprint(lon=npz["lon"], lat=npz["lat"], idx=npz["idx"], val=val, t=npz.get("t"))
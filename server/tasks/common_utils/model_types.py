@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 import pendulum
 from pydantic import BaseModel, ConfigDict
 
@@ -22,3 +24,10 @@ class Namelist(ExtraModel):
     ymx: float
     xres: float
     yres: float
+    receptor_id: Optional[int] = None
+    # 批量模式的受体表 (csv: run_time, lati, long, zagl), 每行一次模拟, 设置时 lati / long / zagl 不使用
+    receptor_table: Optional[str] = None
+    # 只计算这些小时 (YYYY-MM-DD HH:mm:ss), 未设置时计算 t_start ~ t_end 的每个小时
+    run_times: Optional[List[str]] = None
+    # 保留作业目录中已有的输出 (续算)
+    keep_outputs: bool = False
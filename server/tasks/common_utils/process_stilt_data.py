@@ -1,35 +1,185 @@
 import json
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
+from loguru import logger
 from netCDF4 import Dataset
 
+from .footprint_store import Footprint, index_dtype, pyramid_file, save_footprint
 
-def nc_data_to_json(filename: Path, target_path: Path) -> Path:
-    """获取NetCDF(Network Common Data Form) 文件的数据"""
-    fh = Dataset(filename, mode="r")
-    # 获取每个变量的值
-    lons = fh.variables["lon"][:]
-    lats = fh.variables["lat"][:]
-    foot = fh.variables["foot"][:]
+try:
+    # celery prefork 的子进程为 daemon, multiprocessing 不能再创建子进程, billiard 的进程池可以
+    from billiard.pool import Pool as ProcessPool
+except ImportError:
+    ProcessPool = None
+
+# 每次序列化的网格行数 控制写 json 时的内存峰值
+JSON_CHUNK_ROWS = 65536
 
+
+def read_footprint(fh: Dataset) -> Footprint:
+    """
+    读取足迹中的有效网格 (foot > 0), 有效网格顺序与 np.where(foot > 0) 一致
+    足迹有多个时间层时保留每个网格的时间层索引 t
+    """
+    # 关闭 masked array, 直接读取原始数组
+    fh.set_auto_mask(False)
     # lons 保留6位小数
-    lons = np.round(lons, 6)
-    lats = np.round(lats, 6)
+    lons = np.round(fh.variables["lon"][:], 6)
+    lats = np.round(fh.variables["lat"][:], 6)
+    foot = fh.variables["foot"][:]
 
     # 有效值过滤
-    foot_masked = foot > 0
-    time_indices, lat_indices, lng_indices = np.where(foot_masked)
-
-    # 获取有效值
-    data = [
-        (lons[j], lats[i], float(foot[t, i, j]))  # 将numpy类型转换为Python原生类型
-        for t, i, j in zip(time_indices, lat_indices, lng_indices)
-    ]
-
-    fh.close()
-    res = {"columns": ["lng", "lat", "val"], "data": data}
-    json_name = Path(target_path, filename.stem + ".json")
+    time_indices, lat_indices, lng_indices = np.nonzero(foot > 0)
+    vals = foot[time_indices, lat_indices, lng_indices]
+    idx = (lat_indices * lons.size + lng_indices).astype(index_dtype(lons.size, lats.size))
+    t = time_indices.astype(np.uint16) if foot.shape[0] > 1 else None
+    return Footprint(lon=lons, lat=lats, idx=idx, val=vals, t=t)
+
+
+def read_footprint_cells(fh: Dataset):
+    """读取足迹中的有效网格, 返回 (时间层索引, 经度, 纬度, 值) 四个等长的一维数组"""
+    footprint = read_footprint(fh)
+    t = footprint.t if footprint.t is not None else np.zeros(len(footprint), dtype=np.uint16)
+    return t, footprint.lngs, footprint.lats, footprint.val
+
+
+def write_footprint_json(json_name: Path, lngs: np.ndarray, lats: np.ndarray, vals: np.ndarray):
+    """按块写出 {"columns": [...], "data": [[lng, lat, val], ...]}, 与 json.dump 的输出逐字节一致"""
+    cells = np.column_stack((lngs, lats, vals)).astype(np.float64, copy=False)
     with open(json_name, "w") as f:
-        json.dump(res, f)
+        f.write('{"columns": ["lng", "lat", "val"], "data": [')
+        for start in range(0, len(cells), JSON_CHUNK_ROWS):
+            if start:
+                f.write(", ")
+            # 去掉块两端的 [] 后拼接
+            f.write(json.dumps(cells[start : start + JSON_CHUNK_ROWS].tolist())[1:-1])
+        f.write("]}")
+
+
+def nc_data_to_json(filename: Path, target_path: Path) -> Path:
+    """获取NetCDF(Network Common Data Form) 文件的数据"""
+    with Dataset(filename, mode="r") as fh:
+        _, lngs, lats, vals = read_footprint_cells(fh)
+
+    json_name = footprint_out_file(filename, target_path, data_format="json")
+    write_footprint_json(json_name, lngs, lats, vals)
     return json_name
+
+
+def nc_data_to_npz(
+    filename: Path,
+    target_path: Path,
+    encoding: str = "float",
+    floor: float = 0.0,
+    pyramid_levels: int = 0,
+) -> Path:
+    """
+    将 NetCDF 足迹转为稀疏的 .npz 文件, encoding 和 floor 见 save_footprint
+    pyramid_levels: 同时生成 2x, 4x, 8x ... 聚合的金字塔层数
+    """
+    with Dataset(filename, mode="r") as fh:
+        footprint = read_footprint(fh)
+
+    out_file = footprint_out_file(filename, target_path)
+    # 先写金字塔, 原始足迹文件存在即表示转换完成
+    save_pyramid(out_file, footprint, levels=pyramid_levels, encoding=encoding, floor=floor)
+    return save_footprint(out_file, footprint, encoding=encoding, floor=floor)
+
+
+def save_pyramid(out_file: Path, footprint: Footprint, levels: int, **kwargs):
+    """保存足迹金字塔, 网格聚合到不足 2 x 2 时停止"""
+    for level in range(1, levels + 1):
+        factor = 2**level
+        if max(footprint.nx, footprint.ny) < 2 * factor:
+            break
+        save_footprint(pyramid_file(out_file, level), footprint.coarsen(factor), **kwargs)
+
+
+def footprint_out_file(filename: Path, target_path: Path, data_format: str = "npz") -> Path:
+    """足迹文件转换后的输出路径"""
+    suffix = ".json" if data_format == "json" else ".npz"
+    return Path(target_path, filename.stem + suffix)
+
+
+def convert_footprint(
+    filename: Path,
+    target_path: Path,
+    data_format: str = "npz",
+    encoding: str = "float",
+    floor: float = 0.0,
+    pyramid_levels: int = 0,
+) -> Path:
+    """按配置的存储格式转换足迹文件"""
+    if data_format == "json":
+        return nc_data_to_json(filename=filename, target_path=target_path)
+    return nc_data_to_npz(
+        filename=filename,
+        target_path=target_path,
+        encoding=encoding,
+        floor=floor,
+        pyramid_levels=pyramid_levels,
+    )
+
+
+def _convert_footprint_timed(filename: Path, target_path: Path, kwargs: dict):
+    s = time.time()
+    out_file = convert_footprint(filename=filename, target_path=target_path, **kwargs)
+    return out_file, time.time() - s
+
+
+def _collect_results(pending: typing.Iterable[typing.Tuple[Path, typing.Callable]]) -> dict:
+    """等待各文件的转换结果, 返回 {nc 文件: 输出文件}, 失败的文件记录日志后跳过"""
+    results = {}
+    for nc_file, get_result in pending:
+        try:
+            out_file, elapsed = get_result()
+        except Exception as e:
+            logger.error(f"Convert {nc_file} failed: {e}")
+            continue
+        logger.info(f"convert {nc_file.name}: {round(elapsed, 4)}s")
+        results[nc_file] = out_file
+    return results
+
+
+def convert_footprints(
+    nc_files: typing.List[typing.Tuple[Path, Path]], workers: int = 1, **kwargs
+) -> typing.List[typing.Tuple[Path, Path]]:
+    """
+    并行转换足迹文件
+    nc_files: [(nc 文件, 目标目录), ...]
+    kwargs: 传给 convert_footprint 的 data_format / encoding / floor / pyramid_levels
+    返回转换成功的 [(nc 文件, 输出文件), ...], 顺序与输入一致
+    """
+    workers = max(1, min(workers, len(nc_files)))
+    s = time.time()
+    if workers > 1 and ProcessPool is not None:
+        pool = ProcessPool(processes=workers)
+        try:
+            pending = [
+                (
+                    nc_file,
+                    pool.apply_async(_convert_footprint_timed, (nc_file, target_path, kwargs)),
+                )
+                for nc_file, target_path in nc_files
+            ]
+            results = _collect_results((nc_file, result.get) for nc_file, result in pending)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        # 单个 worker 或未安装 billiard 时使用线程池
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = [
+                (nc_file, executor.submit(_convert_footprint_timed, nc_file, target_path, kwargs))
+                for nc_file, target_path in nc_files
+            ]
+            results = _collect_results((nc_file, future.result) for nc_file, future in pending)
+    logger.info(
+        f"convert {len(results)}/{len(nc_files)} footprints with {workers} workers:"
+        f" {round(time.time() - s, 4)}s"
+    )
+    return [(nc_file, results[nc_file]) for nc_file, _ in nc_files if nc_file in results]
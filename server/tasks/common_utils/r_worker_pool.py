@@ -0,0 +1,119 @@
+"""
+常驻 R 进程池
+
+每个 worker 为一个 Rscript stilt_worker.r 进程, 启动时加载一次 STILT, 之后通过 stdin 逐行接收
+run_stilt.r 脚本路径并执行, 避免每个作业重新启动 R 和加载 STILT。
+worker 在 stdout 输出 "@@stilt_worker ok|error <脚本> [错误信息]" 表示脚本执行结束,
+其余输出为 STILT 日志。worker 退出时重新启动。
+进程池在每个进程中只创建一次 (get_r_worker_pool), 进程退出时关闭。
+"""
+
+import atexit
+import queue
+import subprocess
+import threading
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+from tasks.common_utils.exceptions import JobException
+
+MARKER = "@@stilt_worker"
+
+
+class RWorker:
+    def __init__(self, worker_script: Path, stilt_wd: Path):
+        self.worker_script = Path(worker_script).absolute()
+        self.stilt_wd = Path(stilt_wd).absolute()
+        self.process = None
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            ["Rscript", str(self.worker_script), str(self.stilt_wd)],
+            cwd=self.stilt_wd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        status = self.read_status()
+        if status != "ready":
+            self.stop()
+            raise JobException(f"R worker failed to start: {status}")
+        logger.info(f"R worker {self.process.pid} ready")
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=10)
+        except Exception:
+            self.process.kill()
+        self.process = None
+
+    def read_status(self) -> Optional[str]:
+        """读取到状态行为止, 返回状态 (去掉标记), 进程退出时返回 None"""
+        for line in self.process.stdout:
+            line = line.strip()
+            if line.startswith(MARKER):
+                return line[len(MARKER) :].strip()
+            if line:
+                logger.debug(f"R worker {self.process.pid}: {line}")
+        return None
+
+    def run(self, r_script: Path) -> bool:
+        """执行脚本, 返回是否成功; worker 退出时重新启动"""
+        if self.process is None:
+            self.start()
+        try:
+            self.process.stdin.write(f"{Path(r_script).absolute()}\n")
+            self.process.stdin.flush()
+            status = self.read_status()
+        except (BrokenPipeError, OSError) as e:
+            status = None
+            logger.error(f"R worker {self.process.pid} failed: {e}")
+        if status is None:
+            logger.error(f"R worker exited while running {r_script}, restarting")
+            self.stop()
+            self.start()
+            return False
+        if status.startswith("error"):
+            logger.error(f"R script failed: {status[len('error'):].strip()}")
+            return False
+        return True
+
+
+class RWorkerPool:
+    def __init__(self, size: int, worker_script: Path, stilt_wd: Path):
+        self.workers = [RWorker(worker_script, stilt_wd) for _ in range(size)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+
+    def run(self, r_script: Path) -> bool:
+        """在空闲的 worker 中执行脚本, 没有空闲 worker 时等待"""
+        worker = self.idle.get()
+        try:
+            return worker.run(r_script)
+        finally:
+            self.idle.put(worker)
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+_pool: Optional[RWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_r_worker_pool(size: int, worker_script: Path, stilt_wd: Path) -> RWorkerPool:
+    """当前进程的 R 进程池, 第一次调用时启动"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RWorkerPool(size, worker_script, stilt_wd)
+            atexit.register(_pool.close)
+        return _pool
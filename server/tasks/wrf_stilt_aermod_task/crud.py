@@ -7,6 +7,7 @@ import requests
 from loguru import logger
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
 from tasks.common_utils.coordTransform_utils import wgs84toUTMZone50
 
 
@@ -48,9 +49,17 @@ def clean_old_wrf_files(directory_path: Path, days_threshold: int = 3):
     logger.info(f"清理完成: 已删除 {deleted_count} 个文件, 保留 {skipped_count} 个文件")
 
 
+def api_url(path: str) -> str:
+    """
+    model_wrf_stilt 接口地址
+    接口在 i18n_patterns 下, 无语言前缀时会重定向, 重定向会将 POST 变为 GET, 统一使用 /en/ 前缀
+    """
+    return f"{config.API_BASE_URL}/en/api/model_wrf_stilt/{path}"
+
+
 def get_model_config():
     """获取STILT模型列表"""
-    url = "http://127.0.0.1:8000/api/model_wrf_stilt/model_wrf_stilt/"
+    url = api_url("model_wrf_stilt/")
     response = requests.get(url).json()
     if len(response) > 0:
         return response[0]
@@ -58,7 +67,7 @@ def get_model_config():
 
 
 def get_receptors():
-    url = "http://127.0.0.1:8000/api/model_wrf_stilt/receptor/"
+    url = api_url("receptor/")
     receptors = requests.get(url).json()
     res_data = []
     for i in receptors:
@@ -70,8 +79,42 @@ def get_receptors():
     return res_data
 
 
+def save_footprint_catalog(entries: list):
+    """写入足迹索引, 已有的 (受体, 时间) 更新"""
+    url = api_url("footprint_catalog/bulk_upsert/")
+    response = requests.post(url, json=entries)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_footprint_catalog_updates(
+    receptor_id: int, t_start: pendulum.DateTime, t_end: pendulum.DateTime
+) -> dict:
+    """
+    足迹索引中受体 [t_start, t_end] 已有足迹的小时及其更新时间 {YYYYMMDDHHmm: update_time},
+    索引不可用时返回空字典
+    """
+    url = api_url("footprint_catalog/")
+    params = {
+        "receptor_id": receptor_id,
+        "st": t_start.format("YYYYMMDDHHmm"),
+        "et": t_end.add(hours=1).format("YYYYMMDDHHmm"),
+    }
+    try:
+        response = requests.get(url, params=params)
+        response.raise_for_status()
+        updates = {}
+        for entry in response.json():
+            valid_time = pendulum.parse(entry["valid_time"]).in_tz("UTC")
+            updates[valid_time.format("YYYYMMDDHHmm")] = pendulum.parse(entry["update_time"])
+        return updates
+    except Exception as e:
+        logger.warning(f"Get footprint catalog of receptor {receptor_id} failed: {e}")
+        return {}
+
+
 def get_pollution_source():
-    url = "http://127.0.0.1:8000/api/model_wrf_stilt/pollutant_source/"
+    url = api_url("pollutant_source/")
     pollution_sources = requests.get(url).json()
     res_data = []
     for i in pollution_sources:
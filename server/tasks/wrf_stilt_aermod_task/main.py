@@ -29,11 +29,15 @@ def run(
     aermod: bool = True,
     receptor_ids: Optional[str] = None,
     is_delay: bool = False,
+    stilt_batch: bool = config.STILT_BATCH_RUN,
+    force: bool = False,
 ):
     """
     运行 WRF-STILT 模型
     run_date: 运行日期 格式为 YYYY-MM-DD HH:mm:ss 使用UTC时区 仅在 0 6 12 18 点执行
     data_source: 数据源 fnl / gfs
+    stilt_batch: 同一区域的受体在一次 STILT 调用中计算
+    force: 重新计算所有受体小时, 默认跳过本周期气象场已计算出足迹的受体小时
     """
 
     model_config = get_model_config()
@@ -60,6 +64,11 @@ def run(
         directory_path=Path(config.WRFOUT_DATA_PATH),
         days_threshold=model_config["wrf_file_retention_days"],
     )
+    # 瓦片缓存按需重新渲染
+    clean_old_wrf_files(
+        directory_path=Path(config.STILT_TILE_CACHE_PATH),
+        days_threshold=config.STILT_TILE_CACHE_RETENTION_DAYS,
+    )
     max_dom = model_config["max_dom"]
     if wrf:
         process_all_config(model_config, obsgrid=obsgrid_enabled)
@@ -84,7 +93,12 @@ def run(
         run_wrf(obsgrid=obsgrid_enabled, core_nums=model_config["n_cores"], max_dom=max_dom)
 
     if stilt:
-        run_stilt(model_config=model_config, receptor_ids=receptor_ids)
+        run_stilt(
+            model_config=model_config,
+            receptor_ids=receptor_ids,
+            batch=stilt_batch,
+            resume=not force,
+        )
 
 
 if __name__ == "__main__":
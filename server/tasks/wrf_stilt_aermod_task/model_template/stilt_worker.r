@@ -0,0 +1,31 @@
+#!/usr/bin/env Rscript
+# Persistent STILT worker
+# Usage: Rscript stilt_worker.r <stilt_wd>
+# Loads STILT once, then reads the path of a run_stilt.r script per line from
+# stdin and sources it in a fresh environment. After each script a status line
+# '@@stilt_worker ok <script>' or '@@stilt_worker error <script> <message>' is
+# written to stdout; all other output is STILT log output.
+
+args <- commandArgs(trailingOnly = T)
+stilt_wd <- normalizePath(args[1])
+marker <- '@@stilt_worker'
+
+setwd(stilt_wd)
+source('r/dependencies.r')
+
+cat(marker, 'ready\n')
+flush(stdout())
+
+con <- file('stdin', open = 'r')
+while (length(script <- readLines(con, n = 1)) > 0) {
+  status <- tryCatch({
+    source(script, local = new.env(parent = globalenv()))
+    paste('ok', script)
+  }, error = function(e) {
+    paste('error', script, gsub('\n', ' ', conditionMessage(e)))
+  })
+  setwd(stilt_wd)
+  cat(marker, status, '\n')
+  flush(stdout())
+}
+close(con)
@@ -1,65 +1,323 @@
+import csv
 import os
+import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
+import pendulum
 from loguru import logger
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
 from tasks.common_utils.common import (
     check_files_exist_one,
+    get_stilt_cube_file,
     get_stilt_out_filename,
+    get_stilt_receptor_key,
     render_template,
 )
+from tasks.common_utils.conversion_manifest import ConversionManifest
 from tasks.common_utils.decorator import timer
 from tasks.common_utils.exceptions import JobException
+from tasks.common_utils.footprint_cache import FootprintCache
+from tasks.common_utils.footprint_cube import append_footprint
+from tasks.common_utils.footprint_rollup import update_rollups
+from tasks.common_utils.footprint_store import load_footprint
 from tasks.common_utils.model_types import Namelist
-from tasks.common_utils.process_stilt_data import nc_data_to_json
+from tasks.common_utils.process_stilt_data import convert_footprints, footprint_out_file
+from tasks.common_utils.r_worker_pool import get_r_worker_pool
 from tasks.common_utils.shell import create_link_and_backup, run
-from tasks.wrf_stilt_aermod_task.crud import get_receptors
+from tasks.wrf_stilt_aermod_task.crud import (
+    get_footprint_catalog_updates,
+    get_receptors,
+    save_footprint_catalog,
+)
 
 
-@timer()
-def run_instance(namelist: Namelist):
-    logger.info(f"namelist: {namelist.model_dump()}")
-    os.makedirs(config.STILT_DATA_PATH, exist_ok=True)
-    # 1 生成 r 执行文件
+def append_to_cube(job_id: str, footprint_file: Path):
+    """将转换后的足迹追加到受体的足迹时间立方体"""
+    time = pendulum.from_format(job_id[:12], "YYYYMMDDHHmm", tz="UTC")
+    cube_file = get_stilt_cube_file(job_id[13:], cube_path=config.STILT_CUBE_PATH)
+    try:
+        append_footprint(cube_file, time, load_footprint(footprint_file))
+    except Exception as e:
+        logger.error(f"Append {footprint_file} to cube failed: {e}")
+
+
+def group_job_times(job_ids: list) -> dict:
+    """按受体分组 job 的时间 {receptor_key: [time, ...]}"""
+    times = {}
+    for job_id in job_ids:
+        time = pendulum.from_format(job_id[:12], "YYYYMMDDHHmm", tz="UTC")
+        times.setdefault(job_id[13:], []).append(time)
+    return times
+
+
+def update_receptor_rollups(job_ids: list):
+    """重新计算包含新写入小时的日 / 周 / 月聚合"""
+    for receptor_key, times in group_job_times(job_ids).items():
+        cube_file = get_stilt_cube_file(receptor_key, cube_path=config.STILT_CUBE_PATH)
+        if not cube_file.is_file():
+            continue
+        try:
+            update_rollups(cube_file, Path(config.STILT_ROLLUP_PATH, receptor_key), times)
+        except Exception as e:
+            logger.error(f"Update rollups of {receptor_key} failed: {e}")
+
+
+def invalidate_merge_cache(job_ids: list):
+    """删除覆盖新写入小时的足迹合并缓存"""
+    cache = FootprintCache(config.STILT_CACHE_REDIS_URL, config.STILT_CACHE_MAX_BYTES)
+    for receptor_key, times in group_job_times(job_ids).items():
+        cache.invalidate(receptor_key, times)
+
+
+def catalog_footprints(receptor_id: int, footprint_files: list):
+    """将转换后的足迹写入足迹索引: 文件路径, 有效网格数, 总和, 最大值, 范围和加权中心"""
+    entries = []
+    for job_id, footprint_file in footprint_files:
+        try:
+            footprint = load_footprint(footprint_file).sum_layers()
+        except Exception as e:
+            logger.error(f"Read {footprint_file} failed: {e}")
+            continue
+        bounds = footprint.bounds() or [[None, None], [None, None]]
+        centroid = footprint.centroid() or (None, None)
+        time = pendulum.from_format(job_id[:12], "YYYYMMDDHHmm", tz="UTC")
+        entries.append({
+            "receptor": receptor_id,
+            "valid_time": time.to_iso8601_string(),
+            "path": str(footprint_file),
+            "cell_count": len(footprint),
+            "total": float(footprint.val.sum()),
+            "max_value": float(footprint.val.max()) if len(footprint) else 0.0,
+            "min_lat": bounds[0][0],
+            "min_lng": bounds[0][1],
+            "max_lat": bounds[1][0],
+            "max_lng": bounds[1][1],
+            "centroid_lng": centroid[0],
+            "centroid_lat": centroid[1],
+        })
+    if not entries:
+        return
+    try:
+        save_footprint_catalog(entries)
+    except Exception as e:
+        # 合并时按索引规划读取的小时, 索引缺失的小时会被视为没有数据, 作业标记为失败
+        logger.error(f"Save footprint catalog of receptor {receptor_id} failed: {e}")
+        raise JobException(f"Save footprint catalog of receptor {receptor_id} failed: {e}")
+
+
+def job_dir_name(namelists: List[Namelist], batch: bool) -> str:
+    """作业目录名, 同一周期同一作业的目录名不变, 续算时沿用上次的输出"""
+    first = namelists[0]
+    cycle = first.t_start.format("YYYYMMDDHH")
+    if batch:
+        return f"{cycle}_batch_{first.xmn}_{first.xmx}_{first.ymn}_{first.ymx}"
+    return f"{cycle}_{get_stilt_receptor_key(first.long, first.lati, first.zagl)}"
+
+
+def create_job_dir(job_name: str, keep: bool = False) -> Path:
+    """
+    创建作业目录 STILT_JOBS_PATH/<job_name>, 作业有独立的 r/run_stilt.r 和 out,
+    STILT_WD 下的 exe, arlout 等其余文件和 r 下的依赖以符号链接共享, 多个作业可以同时运行
+    keep: 保留已有的作业目录和输出
+    """
+    stilt_wd = Path(config.STILT_WD).absolute()
+    jobs_path = Path(config.STILT_JOBS_PATH).absolute()
+    job_dir = Path(jobs_path, job_name)
+    if job_dir.exists() and not keep:
+        shutil.rmtree(job_dir)
+    Path(job_dir, "r").mkdir(parents=True, exist_ok=True)
+    Path(job_dir, "out").mkdir(exist_ok=True)
+    links = [
+        (Path(job_dir, item.name), item)
+        for item in stilt_wd.iterdir()
+        if item.name not in ("r", "out") and item != jobs_path
+    ]
+    links += [
+        (Path(job_dir, "r", item.name), item)
+        for item in Path(stilt_wd, "r").iterdir()
+        if item.name not in ("run_stilt.r", "receptors.csv")
+    ]
+    for link, item in links:
+        if not link.is_symlink():
+            link.symlink_to(item)
+    return job_dir
+
+
+def clean_old_job_dirs(days_threshold: int = config.STILT_JOB_RETENTION_DAYS):
+    """删除超过指定天数的作业目录"""
+    jobs_path = Path(config.STILT_JOBS_PATH)
+    if not jobs_path.is_dir():
+        return
+    threshold = pendulum.now().subtract(days=days_threshold).timestamp()
+    for job_dir in jobs_path.iterdir():
+        if job_dir.is_dir() and job_dir.stat().st_mtime < threshold:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            logger.debug(f"已删除作业目录: {job_dir}")
+
+
+def write_r_script(namelist: Namelist) -> Path:
+    """在作业目录中生成 r 执行文件"""
     file_content = render_template(
         Path(Path(__file__).parent, "model_template/run_stilt.r.T"), namelist.model_dump()
     )
-    r_config_file = Path(config.STILT_WD, "r", "run_stilt.r")
+    r_config_file = Path(namelist.stilt_wd, "r", "run_stilt.r")
     with open(r_config_file, "w") as f:
         f.write(file_content)
+    # 直接执行 (#!/usr/bin/env Rscript), 需要可执行权限
+    os.chmod(r_config_file, 0o755)
+    return r_config_file
+
+
+def namelist_run_times(namelist: Namelist) -> List[str]:
+    """受体需要计算的小时 (YYYY-MM-DD HH:mm:ss), 未设置 run_times 时为 t_start ~ t_end 的每个小时"""
+    if namelist.run_times is not None:
+        return namelist.run_times
+    hours = int((namelist.t_end - namelist.t_start).total_hours())
+    return [namelist.t_start.add(hours=h).to_datetime_string() for h in range(hours + 1)]
+
+
+def write_receptor_table(namelists: List[Namelist], table_file: Path) -> int:
+    """批量模式的受体表, 每行一个受体的一个小时, 返回行数"""
+    rows = [
+        [run_time, namelist.lati, namelist.long, namelist.zagl]
+        for namelist in namelists
+        for run_time in namelist_run_times(namelist)
+    ]
+    with open(table_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["run_time", "lati", "long", "zagl"])
+        writer.writerows(rows)
+    return len(rows)
+
+
+def run_r_script(r_config_file: Path):
+    """执行 r 文件, STILT_R_WORKERS 大于 0 时提交到常驻 R 进程池, 否则启动新的 Rscript"""
+    if config.STILT_R_WORKERS > 0:
+        pool = get_r_worker_pool(
+            config.STILT_R_WORKERS,
+            Path(Path(__file__).parent, "model_template/stilt_worker.r"),
+            Path(config.STILT_WD),
+        )
+        pool.run(r_config_file)
+    else:
+        run(cmd=r_config_file)
+
+
+@timer()
+def run_instance(namelist: Namelist):
+    # 0 创建作业目录
+    job_dir = create_job_dir(job_dir_name([namelist], batch=False), keep=namelist.keep_outputs)
+    namelist = namelist.model_copy(update={"stilt_wd": str(job_dir)})
+    logger.info(f"namelist: {namelist.model_dump()}")
+    # 续算时所有小时都已有 STILT 输出, 只需转换
+    if namelist_run_times(namelist):
+        # 1 生成 r 执行文件
+        r_config_file = write_r_script(namelist)
+
+        # 2 执行 r 文件
+        run_r_script(r_config_file)
+
+    process_outputs(namelist)
+
+
+@timer()
+def run_batch(namelists: List[Namelist]):
+    """
+    一次 STILT 调用计算多个受体, 受体需使用相同的足迹网格 (区域范围和分辨率),
+    R 启动, 加载 STILT 和气象文件索引只执行一次, n_cores 个进程在所有受体的所有小时间分配
+    """
+    logger.info(f"batch receptors: {[n.receptor_id for n in namelists]}")
+    job_dir = create_job_dir(
+        job_dir_name(namelists, batch=True), keep=any(n.keep_outputs for n in namelists)
+    )
+    namelists = [n.model_copy(update={"stilt_wd": str(job_dir)}) for n in namelists]
+    table_file = Path(job_dir, "r", "receptors.csv")
+    if write_receptor_table(namelists, table_file):
+        r_config_file = write_r_script(
+            namelists[0].model_copy(update={"receptor_table": str(table_file), "run_times": None})
+        )
+        run_r_script(r_config_file)
+
+    # 各受体分别检查和转换结果, 一个受体失败不影响其他受体
+    for namelist in namelists:
+        try:
+            process_outputs(namelist)
+        except Exception as e:
+            logger.error(f"Receptor {namelist.receptor_id} failed: {e}")
 
-    # 2 执行 r 文件
-    run(cmd=r_config_file)
 
+def process_outputs(namelist: Namelist):
+    """检查受体的 STILT 输出并转换保存"""
+    os.makedirs(config.STILT_DATA_PATH, exist_ok=True)
+    os.makedirs(config.STILT_CUBE_PATH, exist_ok=True)
     # 3 检查输出结果 由于gfs文件可能有缺失 仅验证是否有文件生成 不验证数量
-    output_files = get_stilt_out_filename(namelist, stilt_wd=config.STILT_WD)
-    flag, error_files = check_files_exist_one(output_files, all_exist=False)
-    if not flag:
+    output_files = get_stilt_out_filename(namelist, stilt_wd=namelist.stilt_wd)
+    # 续算时只检查本次计算的小时, 之前的输出由 manifest 判断是否需要转换
+    run_times = {
+        pendulum.parse(t, tz="UTC").format("YYYYMMDDHHmm") for t in namelist_run_times(namelist)
+    }
+    expected_files = [f for f in output_files if Path(f).parent.name[:12] in run_times]
+    flag, error_files = check_files_exist_one(expected_files, all_exist=False)
+    if expected_files and not flag:
         logger.error(f"Files not generate: {error_files}")
         raise JobException("Files not generate.")
 
-    # 4 将结果转为json格式 保存到指定目录
-    stilt_out_path = Path(config.STILT_WD, "out/by-id")
-    dirs = list(stilt_out_path.iterdir())
-    for file_dir in dirs:
-        date_path = file_dir.name[:8]
-        target_path = Path(config.STILT_DATA_PATH, date_path)
+    # 4 将本次生成的结果转为稀疏存储格式 保存到指定目录, 并追加到受体的足迹时间立方体
+    receptor_key = get_stilt_receptor_key(namelist.long, namelist.lati, namelist.zagl)
+    manifest = ConversionManifest(Path(config.STILT_MANIFEST_PATH, f"{receptor_key}.json"))
+    nc_files = []
+    for nc_file in map(Path, output_files):
+        if not nc_file.is_file():
+            continue
+        target_path = Path(config.STILT_DATA_PATH, nc_file.parent.name[:8])
+        out_file = footprint_out_file(nc_file, target_path, data_format=config.STILT_DATA_FORMAT)
+        if manifest.is_converted(nc_file, out_file):
+            logger.info(f"{nc_file.name} not changed, skip")
+            continue
         if not target_path.is_dir():
             target_path.mkdir(parents=True)
-        for f in Path(stilt_out_path, file_dir).iterdir():
-            if f.suffix == ".nc":
-                nc_file = Path(stilt_out_path, file_dir, f)
-                nc_data_to_json(filename=nc_file, target_path=target_path)
+        nc_files.append((nc_file, target_path))
+
+    workers = config.STILT_POSTPROCESS_WORKERS or namelist.n_cores
+    results = convert_footprints(
+        nc_files,
+        workers=workers,
+        data_format=config.STILT_DATA_FORMAT,
+        encoding=config.STILT_DATA_ENCODING,
+        floor=config.STILT_FOOT_FLOOR if config.STILT_DATA_ENCODING == "log16" else 0.0,
+        pyramid_levels=config.STILT_PYRAMID_LEVELS,
+    )
+    # 立方体只能单进程追加, 按时间顺序写入
+    for nc_file, footprint_file in results:
+        manifest.update(nc_file, footprint_file)
+        append_to_cube(job_id=nc_file.parent.name, footprint_file=footprint_file)
+    manifest.save()
+    job_ids = [nc_file.parent.name for nc_file, _ in results]
+    update_receptor_rollups(job_ids)
+    invalidate_merge_cache(job_ids)
+    if namelist.receptor_id is not None:
+        catalog_footprints(
+            namelist.receptor_id,
+            [(nc_file.parent.name, footprint_file) for nc_file, footprint_file in results],
+        )
+
+
+def stilt_wrfout_file(model_config, run_date: pendulum.DateTime) -> Path:
+    """STILT 使用的 wrfout 文件, 包含 (run_date - 6h) ~ run_date 的气象场"""
+    date_str = run_date.subtract(hours=6).format("YYYY-MM-DD_HH:mm:ss")
+    return Path(config.WRFOUT_DATA_PATH, f"wrfout_d0{model_config['stilt_wrf_dom']}_{date_str}")
 
 
-def run_stilt(model_config, receptor_ids: Optional[str] = None):
+def prepare_stilt(model_config) -> Tuple[pendulum.DateTime, pendulum.DateTime]:
     """
-    运行 STILT 模型
-    run_date: 运行日期 使用UTC时区， 计算时段为 (run_date - 6h) ~ run_date
+    将 wrfout 转换为 STILT 使用的 ARL 格式
+    run_date: 运行日期 使用UTC时区， 计算时段为 (run_date - 6h) ~ run_date, 返回计算时段
     """
     os.chdir(Path(config.STILT_WD))
     if not Path("arlout").is_dir():
@@ -72,20 +330,70 @@ def run_stilt(model_config, receptor_ids: Optional[str] = None):
     target_f2 = Path(config.STILT_WD, "exe/WRFDATA.CFG")
     if not target_f2.is_file():
         create_link_and_backup(source_file=config_f2, target_file=target_f2)
-    date_str = run_date.subtract(hours=6).format("YYYY-MM-DD_HH:mm:ss")
-    wrfout_file = f"wrfout_d0{model_config['stilt_wrf_dom']}_{date_str}"
+    wrfout_file = stilt_wrfout_file(model_config, run_date).name
     wrfout_file_arl = f"{wrfout_file}.ARL"
     if not Path(config.WRFOUT_DATA_PATH, wrfout_file).is_file():
         logger.error(f"wrfout file :{wrfout_file} not exist.")
         raise JobException("wrfout file not exist.")
     run(f"exe/arw2arl -i{config.WRFOUT_DATA_PATH}/{wrfout_file} -oarlout/{wrfout_file_arl}")
+    return run_date.subtract(hours=6), run_date
+
+
+def resume_namelist(
+    namelist: Namelist, job_dir: Path, met_time: Optional[float] = None
+) -> Optional[Namelist]:
+    """
+    续算: 已转换 (STILT_DATA_PATH 中有输出文件) 或足迹索引中已有的小时不再计算,
+    作业目录中已有 _foot.nc 的小时只需转换; 所有小时都已完成时返回 None
+    met_time: 本周期气象文件的修改时间 (timestamp), 早于它的结果由上一周期的气象场计算
+    (如与上一周期重叠的 t_start), 需要重新计算
+    """
+
+    def is_current(file: Path) -> bool:
+        return file.is_file() and (met_time is None or file.stat().st_mtime >= met_time)
+
+    catalog_updates = get_footprint_catalog_updates(
+        namelist.receptor_id, namelist.t_start, namelist.t_end
+    )
+    run_times, convert_count = [], 0
+    for nc_file in map(Path, get_stilt_out_filename(namelist, stilt_wd=str(job_dir))):
+        time_key = nc_file.parent.name[:12]
+        target_path = Path(config.STILT_DATA_PATH, time_key[:8])
+        out_file = footprint_out_file(nc_file, target_path, data_format=config.STILT_DATA_FORMAT)
+        updated = catalog_updates.get(time_key)
+        if is_current(out_file) or (
+            updated is not None and (met_time is None or updated.timestamp() >= met_time)
+        ):
+            continue
+        convert_count += 1
+        if not is_current(nc_file):
+            # 旧的输出由 STILT 重新生成
+            if nc_file.parent.is_dir():
+                shutil.rmtree(nc_file.parent, ignore_errors=True)
+            run_times.append(pendulum.from_format(time_key, "YYYYMMDDHHmm").to_datetime_string())
+    if not convert_count:
+        return None
+    return namelist.model_copy(update={"run_times": run_times, "keep_outputs": True})
+
 
-    t_start = run_date.subtract(hours=6)
-    t_end = run_date
+def build_stilt_jobs(
+    model_config,
+    t_start: pendulum.DateTime,
+    t_end: pendulum.DateTime,
+    receptor_ids: Optional[str] = None,
+    batch: bool = config.STILT_BATCH_RUN,
+    resume: bool = True,
+) -> List[List[Namelist]]:
+    """
+    STILT 作业列表, 每个作业为一组受体的 namelist
+    batch: 足迹网格相同 (同一区域) 的受体为一个作业, 否则每个受体一个作业
+    resume: 只计算缺少足迹或足迹早于本周期气象文件的受体小时, 已全部完成的受体不加入作业
+    """
     receptor_list = get_receptors()
     if receptor_ids:
         receptor_ids = receptor_ids.split(",")
         receptor_list = [r for r in receptor_list if str(r["id"]) in receptor_ids]
+    namelists = []
     for receptor in receptor_list:
         namelist = Namelist(
             stilt_wd=config.STILT_WD,
@@ -101,14 +409,90 @@ def run_stilt(model_config, receptor_ids: Optional[str] = None):
             ymx=receptor["region"]["ymx"],
             xres=model_config["xres"],
             yres=model_config["yres"],
+            receptor_id=receptor["id"],
         )
-        try:
-            print(f"namelist: {namelist.model_dump()}")
-            run_instance(namelist)
-        except Exception as e:
-            logger.error(f"Job failed: {e}")
-            # raise JobException(e)
-            continue
+        namelists.append(namelist)
+
+    if not batch:
+        jobs = [[namelist] for namelist in namelists]
+    else:
+        groups = {}
+        for namelist in namelists:
+            groups.setdefault((namelist.xmn, namelist.xmx, namelist.ymn, namelist.ymx), []).append(
+                namelist
+            )
+        jobs = list(groups.values())
+    if not resume:
+        return jobs
+
+    wrfout_file = stilt_wrfout_file(model_config, t_end)
+    met_time = wrfout_file.stat().st_mtime if wrfout_file.is_file() else None
+    resumed_jobs = []
+    for job in jobs:
+        job_dir = Path(config.STILT_JOBS_PATH, job_dir_name(job, batch=batch))
+        job = [n for n in (resume_namelist(n, job_dir, met_time) for n in job) if n is not None]
+        if job:
+            resumed_jobs.append(job)
+    logger.info(
+        f"resume: {sum(map(len, resumed_jobs))} of {len(namelists)} receptors,"
+        f" {sum(len(n.run_times) for job in resumed_jobs for n in job)} receptor hours to run"
+    )
+    return resumed_jobs
+
+
+def dump_job(namelists: List[Namelist]) -> List[dict]:
+    """作业序列化为 json, 用于 celery 子任务"""
+    return [namelist.model_dump(mode="json") for namelist in namelists]
+
+
+def load_job(data: List[dict]) -> List[Namelist]:
+    return [
+        Namelist(**{
+            **item,
+            "t_start": pendulum.parse(item["t_start"]),
+            "t_end": pendulum.parse(item["t_end"]),
+        })
+        for item in data
+    ]
+
+
+def run_stilt_job(namelists: List[Namelist], batch: bool = config.STILT_BATCH_RUN) -> dict:
+    """运行一个作业, 返回状态 {receptor_ids, ok, error}"""
+    status = {"receptor_ids": [n.receptor_id for n in namelists], "ok": True, "error": None}
+    try:
+        if batch:
+            run_batch(namelists)
+        else:
+            for namelist in namelists:
+                run_instance(namelist)
+    except Exception as e:
+        logger.error(f"Job failed: {e}")
+        # raise JobException(e)
+        status.update(ok=False, error=str(e))
+    return status
+
+
+def run_stilt(
+    model_config,
+    receptor_ids: Optional[str] = None,
+    batch: bool = config.STILT_BATCH_RUN,
+    resume: bool = True,
+):
+    """
+    运行 STILT 模型
+    run_date: 运行日期 使用UTC时区， 计算时段为 (run_date - 6h) ~ run_date
+    batch: 足迹网格相同 (同一区域) 的受体在一次 STILT 调用中计算, 否则每个受体分别调用
+    resume: 跳过已有足迹的受体小时, False 时重新计算所有受体小时
+    每个作业在独立的作业目录中运行, 最多同时运行 STILT_PARALLEL_JOBS 个作业
+    """
+    t_start, t_end = prepare_stilt(model_config)
+    jobs = build_stilt_jobs(
+        model_config, t_start, t_end, receptor_ids=receptor_ids, batch=batch, resume=resume
+    )
+
+    clean_old_job_dirs()
+    with ThreadPoolExecutor(max_workers=max(1, config.STILT_PARALLEL_JOBS)) as executor:
+        list(executor.map(partial(run_stilt_job, batch=batch), jobs))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+"""
+足迹接口的响应格式
+
+由 resp_type 参数选择, 未指定时按 Accept 头选择, 默认 json
+(DRF 的 format 参数用于选择 renderer, 不能用于这里):
+    json    {"columns": [...], "data": [[lng, lat, val], ...], ...}        application/json
+    arrow   Arrow IPC stream, 列 lng, lat, val (t), 其余字段以 json 保存在
+            schema metadata 的 "meta" 中                                   application/vnd.apache.arrow.stream
+    binary  [uint32 头长度][json 头][补齐到 4 字节][float32 列 lng][lat][val]([t])
+            头包含 columns, rows 和其余字段, 小端序                          application/octet-stream
+    png     图片
+多个受体的足迹 (encode_footprints):
+    json    {"receptors": [{"columns": [...], "data": [...], ...}, ...], ...}
+    arrow   一个表, 增加 receptor_id 列, 各受体的字段以 json 列表保存在 metadata 的 "receptors" 中
+    binary  头 {"receptors": 受体数, ...} (无数据列), 其后依次为各受体的 binary 足迹
+除 png 外按 Accept-Encoding 压缩, zstd 优先, 其次 gzip。
+pyarrow 和 zstandard 为可选依赖, 未安装时 arrow 格式返回 406, 不使用 zstd 压缩。
+"""
+
+import gzip
+import json
+import struct
+import typing
+
+import numpy as np
+from django.http import HttpResponse
+from tasks.common_utils.footprint_store import Footprint
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "binary": "application/octet-stream",
+    "png": "image/png",
+}
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = 1024
+
+
+class FormatNotAvailable(Exception):
+    """请求的格式依赖的可选包未安装"""
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        return None
+    return pyarrow
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def negotiate_format(request, resp_type: typing.Optional[str]) -> str:
+    """其他 resp_type 与原接口一致按 json 返回, 格式不可用时抛出 FormatNotAvailable"""
+    if resp_type:
+        fmt = resp_type.lower() if resp_type.lower() in CONTENT_TYPES else "json"
+    else:
+        accept = request.META.get("HTTP_ACCEPT", "")
+        fmt = next((f for f, ct in CONTENT_TYPES.items() if f != "png" and ct in accept), "json")
+    if fmt == "arrow" and _import_pyarrow() is None:
+        raise FormatNotAvailable("Arrow format requires pyarrow")
+    return fmt
+
+
+def negotiate_encoding(request, fmt: str) -> typing.Optional[str]:
+    """按 Accept-Encoding 选择压缩方式, 不压缩返回 None"""
+    if fmt == "png":
+        return None
+    accepted = set()
+    for item in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(coding.strip().lower())
+    if "zstd" in accepted and _import_zstandard() is not None:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def _footprint_columns(footprint: Footprint, with_layers: bool) -> dict:
+    columns = {"lng": footprint.lngs, "lat": footprint.lats, "val": footprint.val}
+    if with_layers:
+        columns["t"] = footprint.t if footprint.t is not None else np.zeros(len(footprint))
+    return columns
+
+
+def encode_footprint(
+    footprint: Footprint, fmt: str, meta: dict, with_layers: bool = False
+) -> bytes:
+    """编码 json / arrow / binary 格式, meta 为 columns, data 之外的字段"""
+    if fmt == "json":
+        data = footprint.to_dict(with_layers=with_layers)
+        data.update(meta)
+        return json.dumps(data).encode()
+
+    columns = _footprint_columns(footprint, with_layers)
+    if fmt == "arrow":
+        pa = _import_pyarrow()
+        table = pa.table(
+            {name: np.asarray(values) for name, values in columns.items()},
+            metadata={"meta": json.dumps(meta)},
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    if fmt == "binary":
+        return _binary_frame({"columns": list(columns), "rows": len(footprint), **meta}, columns)
+
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def _binary_frame(header: dict, columns: typing.Dict[str, np.ndarray]) -> bytes:
+    header = json.dumps(header).encode()
+    header += b" " * (-(len(header) + 4) % 4)
+    body = [struct.pack("<I", len(header)), header]
+    body += [np.asarray(values, dtype="<f4").tobytes() for values in columns.values()]
+    return b"".join(body)
+
+
+def encode_footprints(
+    footprints: typing.List[typing.Tuple[dict, Footprint]],
+    fmt: str,
+    meta: dict,
+    with_layers: bool = False,
+) -> bytes:
+    """
+    编码多个足迹, footprints: [(各足迹的字段, 足迹)], meta 为整体的字段
+    json / arrow / binary 格式见模块说明
+    """
+    if fmt == "json":
+        receptors = []
+        for item_meta, footprint in footprints:
+            data = footprint.to_dict(with_layers=with_layers)
+            data.update(item_meta)
+            receptors.append(data)
+        return json.dumps({"receptors": receptors, **meta}).encode()
+
+    if fmt == "arrow":
+        pa = _import_pyarrow()
+        columns = {}
+        for _, footprint in footprints:
+            for name, values in _footprint_columns(footprint, with_layers).items():
+                columns.setdefault(name, []).append(np.asarray(values))
+        table = pa.table(
+            {
+                "receptor_id": np.repeat(
+                    [item_meta.get("receptor_id", -1) for item_meta, _ in footprints],
+                    [len(footprint) for _, footprint in footprints],
+                ).astype(np.int64),
+                **{name: np.concatenate(values) for name, values in columns.items()},
+            },
+            metadata={
+                "meta": json.dumps(meta),
+                "receptors": json.dumps([item_meta for item_meta, _ in footprints]),
+            },
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    if fmt == "binary":
+        body = [_binary_frame({"receptors": len(footprints), **meta}, {})]
+        body += [
+            encode_footprint(footprint, fmt, item_meta, with_layers)
+            for item_meta, footprint in footprints
+        ]
+        return b"".join(body)
+
+    raise ValueError(f"Unknown format: {fmt}")
+
+
+def make_response(body: bytes, fmt: str, encoding: typing.Optional[str]) -> HttpResponse:
+    """按 encoding 压缩并设置 Content-Encoding"""
+    response_encoding = encoding if encoding and len(body) >= COMPRESS_MIN_SIZE else None
+    if response_encoding == "zstd":
+        body = _import_zstandard().ZstdCompressor(level=3).compress(body)
+    elif response_encoding == "gzip":
+        body = gzip.compress(body, compresslevel=6)
+    response = HttpResponse(body, content_type=CONTENT_TYPES[fmt])
+    if response_encoding:
+        response["Content-Encoding"] = response_encoding
+    response["Vary"] = "Accept, Accept-Encoding"
+    return response
@@ -0,0 +1,69 @@
+"""
+足迹接口的 HTTP 缓存
+
+ETag 由数据文件的路径, mtime 和大小以及请求参数计算, Last-Modified 取文件的最新 mtime。
+请求带 If-None-Match / If-Modified-Since 且数据未变化时返回 304。
+结束时间早于 STILT_HTTP_RECENT_HOURS 的历史时段设置较长的 Cache-Control,
+最近的时段可能被下一次计算覆盖, 要求客户端每次校验。
+"""
+
+import hashlib
+import typing
+from pathlib import Path
+
+import config as cfg
+import pendulum
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class Validators(typing.NamedTuple):
+    etag: str
+    last_modified: int
+    cache_control: str
+
+
+def file_validators(
+    files: typing.Iterable[Path], et: pendulum.DateTime, *params
+) -> typing.Optional[Validators]:
+    """
+    files: 生成响应用到的文件 (或目录), et: 数据时段的结束时间, params: 影响响应内容的请求参数
+    文件都不存在时返回 None
+    """
+    sha1 = hashlib.sha1()
+    last_modified = None
+    for file in files:
+        try:
+            stat = Path(file).stat()
+        except OSError:
+            continue
+        sha1.update(f"{file}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+        last_modified = max(last_modified or 0, int(stat.st_mtime))
+    if last_modified is None:
+        return None
+    sha1.update("|".join(str(p) for p in params).encode())
+
+    if et.add(hours=cfg.STILT_HTTP_RECENT_HOURS) < pendulum.now("UTC"):
+        cache_control = f"public, max-age={cfg.STILT_HTTP_MAX_AGE}"
+    else:
+        cache_control = "public, no-cache"
+    return Validators(quote_etag(sha1.hexdigest()), last_modified, cache_control)
+
+
+def set_cache_headers(response: HttpResponse, validators: typing.Optional[Validators]):
+    if validators and 200 <= response.status_code < 400:
+        response["ETag"] = validators.etag
+        response["Last-Modified"] = http_date(validators.last_modified)
+        response["Cache-Control"] = validators.cache_control
+    return response
+
+
+def not_modified(request, validators: typing.Optional[Validators]) -> typing.Optional[HttpResponse]:
+    """条件请求命中时返回 304 响应, 否则返回 None"""
+    if validators is None:
+        return None
+    response = get_conditional_response(
+        request, etag=validators.etag, last_modified=validators.last_modified
+    )
+    return set_cache_headers(response, validators) if response is not None else None
@@ -1,16 +1,30 @@
 import json
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
-from io import BytesIO
 from pathlib import Path
 
 import config as cfg
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.collections import PatchCollection
-from matplotlib.colors import Normalize
-from matplotlib.patches import Rectangle
+import pendulum
+from loguru import logger
 from netCDF4 import Dataset
+from tasks.common_utils import footprint_cube, footprint_rollup, footprint_store
+from tasks.common_utils.common import get_stilt_cube_file, get_stilt_receptor_key
+from tasks.common_utils.footprint_cache import FootprintCache
+from tasks.common_utils.footprint_store import (
+    Footprint,
+    FootprintSum,
+    GridAccumulator,
+    sum_footprints,
+)
+from tasks.common_utils.process_stilt_data import read_footprint_cells
+from utils import utils_render
+
+# 足迹文件后缀, 按优先级排列
+FOOTPRINT_SUFFIXES = (".npz", ".json")
+# 多进程共享的足迹合并结果缓存
+merge_cache = FootprintCache(cfg.STILT_CACHE_REDIS_URL, cfg.STILT_CACHE_MAX_BYTES)
 
 
 @lru_cache(maxsize=10)
@@ -18,20 +32,278 @@ def get_nc_data(
     filename: Path,
 ) -> typing.Tuple[typing.Tuple[str], typing.List[typing.Tuple[float]]]:
     """获取NetCDF(Network Common Data Form) 文件的数据"""
-    with open(filename, "r") as f:
-        res = json.loads(f.read())
-    return res
+    if Path(filename).suffix == ".json":
+        with open(filename, "r") as f:
+            res = json.loads(f.read())
+        return res
+    return load_footprint(filename).to_dict()
+
+
+def load_footprint(filename: Path) -> Footprint:
+    """
+    获取足迹数组, 兼容 .npz 和 .json
+    .npz 为内存映射, 各 worker 共享系统页缓存; 缓存以 mtime 区分, 文件重新生成后自动失效
+    """
+    return _load_footprint(filename, Path(filename).stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=32)
+def _load_footprint(filename: Path, mtime_ns: int) -> Footprint:
+    return footprint_store.load_footprint(filename)
 
 
 def parse_file_name(time: str, lng: float, lat: float, hight: int) -> Path:
-    """获取文件路径 stilt_data/20240418/202404182100_117.1914_36.9719_2_foot.nc"""
+    """获取文件路径 stilt_data/20240418/202404182100_117.1914_36.9719_2_foot.npz, 兼容旧的 .json"""
     lng = int(lng) if int(lng) == lng else lng
     lat = int(lat) if int(lat) == lat else lat
-    file = f"{time}_{lng}_{lat}_{hight}_foot.json"
-    path = Path(cfg.STILT_DATA_PATH).joinpath(time[:8]).joinpath(file)
-    if not path.exists():
-        raise FileNotFoundError(f"文件 {path}不存在")
-    return path
+    path = Path(cfg.STILT_DATA_PATH).joinpath(time[:8]).joinpath(f"{time}_{lng}_{lat}_{hight}_foot")
+    for suffix in FOOTPRINT_SUFFIXES:
+        file = path.with_name(path.name + suffix)
+        if file.exists():
+            return file
+    raise FileNotFoundError(f"文件 {path}.npz 不存在")
+
+
+def catalog_file(path: str) -> typing.Optional[Path]:
+    """足迹索引中的文件路径, 不在 STILT_DATA_PATH 下或文件不存在时返回 None"""
+    try:
+        file = Path(path).resolve()
+    except (OSError, RuntimeError, TypeError, ValueError):
+        return None
+    if not file.is_relative_to(Path(cfg.STILT_DATA_PATH).resolve()) or not file.is_file():
+        return None
+    return file
+
+
+def hour_end(time: str) -> pendulum.DateTime:
+    """足迹时间 YYYYMMDDHHmm 所在小时的结束时间"""
+    return pendulum.from_format(time[:12], "YYYYMMDDHHmm", tz="UTC").add(hours=1)
+
+
+def merge_source_files(
+    st: pendulum.DateTime, et: pendulum.DateTime, lng: float, lat: float, hight: int
+) -> typing.List[Path]:
+    """
+    合并 [st, et) 用到的数据: 受体的足迹时间立方体和逐日的足迹目录
+    写入或替换足迹文件时目录的 mtime 随之更新
+    """
+    receptor_key = get_stilt_receptor_key(lng, lat, hight)
+    files = [get_stilt_cube_file(receptor_key, cube_path=cfg.STILT_CUBE_PATH)]
+    day = st.start_of("day")
+    while day < et:
+        files.append(Path(cfg.STILT_DATA_PATH, day.format("YYYYMMDD")))
+        day = day.add(days=1)
+    return files
+
+
+def pyramid_level(
+    footprint: Footprint, level: typing.Optional[int] = None, zoom: typing.Optional[int] = None
+) -> int:
+    """
+    金字塔层级, 直接指定 level, 或按地图缩放级别 zoom (不小于 0) 选择网格不小于一个像素的最粗层级
+    (256 像素瓦片, zoom 级别每像素 360 / (256 * 2 ** zoom) 度), 不超过 STILT_PYRAMID_LEVELS
+    """
+    if level is not None:
+        return min(max(0, level), cfg.STILT_PYRAMID_LEVELS)
+    if zoom is None or footprint.resolution == 0:
+        return 0
+    pixel_deg = 360 / (256 * 2**zoom)
+    if pixel_deg <= footprint.resolution:
+        return 0
+    level = int(np.floor(np.log2(pixel_deg / footprint.resolution)))
+    return min(level, cfg.STILT_PYRAMID_LEVELS)
+
+
+def find_pyramid_file(file: Path, level: int) -> typing.Tuple[Path, int]:
+    """返回不高于 level 的最高已生成层级的文件"""
+    for lv in range(level, 0, -1):
+        pyramid = footprint_store.pyramid_file(file, lv)
+        if pyramid.exists():
+            return pyramid, lv
+    return file, 0
+
+
+def parse_layer(layer: typing.Optional[str]) -> typing.Union[str, int]:
+    """
+    解析时间层参数
+    sum(默认): 合并所有时间层 / all: 保留时间层 / 整数: 选择单个时间层
+    """
+    if layer in (None, "", "sum"):
+        return "sum"
+    if layer == "all":
+        return layer
+    layer = int(layer)
+    if layer < 0:
+        raise ValueError("layer must be sum, all or a non-negative integer")
+    return layer
+
+
+def apply_layer(footprint: Footprint, layer: typing.Union[str, int]) -> Footprint:
+    if layer == "sum":
+        return footprint.sum_layers()
+    if layer == "all":
+        return footprint
+    return footprint.select_layer(layer)
+
+
+def parse_filters(query_params) -> dict:
+    """
+    解析网格筛选参数, 未指定的为 None
+    bbox: min_lng,min_lat,max_lng,max_lat / min_value: 最小值 / top_n: 值最大的网格数
+    """
+    bbox = query_params.get("bbox")
+    if bbox:
+        bbox = tuple(float(v) for v in bbox.split(","))
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    min_value = query_params.get("min_value")
+    min_value = float(min_value) if min_value else None
+    top_n = query_params.get("top_n")
+    top_n = int(top_n) if top_n else None
+    if top_n is not None and top_n <= 0:
+        raise ValueError("top_n must be a positive integer")
+    return {"bbox": bbox or None, "min_value": min_value, "top_n": top_n}
+
+
+def filters_key(filters: typing.Optional[dict]) -> str:
+    """筛选参数的字符串形式, 用于缓存 key 和 ETag, 未筛选时为空"""
+    if not filters or all(v is None for v in filters.values()):
+        return ""
+    bbox = filters.get("bbox")
+    return ";".join([
+        ",".join(str(v) for v in bbox) if bbox else "",
+        str(filters.get("min_value") or ""),
+        str(filters.get("top_n") or ""),
+    ])
+
+
+def merge_cache_key(
+    st: pendulum.DateTime,
+    et: pendulum.DateTime,
+    lng: float,
+    lat: float,
+    hight: int,
+    resp_type: str,
+    layer: typing.Union[str, int] = "sum",
+    filters: typing.Optional[dict] = None,
+) -> str:
+    receptor_key = get_stilt_receptor_key(lng, lat, hight)
+    return FootprintCache.make_key(
+        receptor_key, st, et, resp_type or "json", layer, filters_key(filters)
+    )
+
+
+def merge_footprints(
+    st: pendulum.DateTime,
+    et: pendulum.DateTime,
+    lng: float,
+    lat: float,
+    hight: int,
+    layer: typing.Union[str, int] = "sum",
+    grid: typing.Optional[dict] = None,
+    files: typing.Optional[typing.Dict[str, Path]] = None,
+) -> typing.Tuple[Footprint, typing.List[str]]:
+    """
+    计算 [st, et) 内逐小时足迹的逐网格平均值
+    优先使用受体的日 / 周 / 月聚合, 其余时段从足迹时间立方体读取, 都没有的小时再读取逐小时文件
+    聚合和立方体只保存合并后的时间层, 选择单个时间层时只读取逐小时文件
+    grid: 区域网格 {xmn, xmx, ymn, ymx, xres, yres}, 在预分配的网格数组上累加;
+    未提供时按经纬度合并
+    files: 足迹索引中的逐小时文件 {YYYYMMDDHH00: 文件}, 提供时其余小时视为缺失, 不再查找文件
+    返回 (平均足迹, 缺失的小时)
+    """
+    parts = []
+    accumulator = GridAccumulator(**grid) if grid else None
+
+    def add(fsum: FootprintSum):
+        accumulator.add(fsum) if accumulator else parts.append(fsum)
+
+    # 已求和的小时 (hours since 1970)
+    covered = set()
+    receptor_key = get_stilt_receptor_key(lng, lat, hight)
+    if layer == "sum":
+        # 先取完整对齐的日 / 周 / 月聚合, 剩余时段从立方体读取
+        segments = [(st, et)]
+        rollup_dir = Path(cfg.STILT_ROLLUP_PATH, receptor_key)
+        if rollup_dir.is_dir():
+            rollups, segments = footprint_rollup.read_rollups(rollup_dir, st, et)
+            for fsum, hours in rollups:
+                add(fsum)
+                covered.update(hours.tolist())
+        cube_file = get_stilt_cube_file(receptor_key, cube_path=cfg.STILT_CUBE_PATH)
+        if cube_file.is_file():
+            try:
+                for seg_st, seg_et in segments:
+                    fsum, hours = footprint_cube.read_range(cube_file, seg_st, seg_et)
+                    add(fsum)
+                    covered.update(hours.tolist())
+            except Exception as e:
+                logger.error(f"Read cube {cube_file} failed: {e}")
+
+    not_exist_files = []
+    time = st
+    while time < et:
+        tm_str = time.format("YYYYMMDDHH00")
+        if footprint_cube.to_hours(time) in covered:
+            pass
+        elif files is not None and tm_str not in files:
+            not_exist_files.append(tm_str)
+        else:
+            try:
+                if files is not None:
+                    file = files[tm_str]
+                else:
+                    file = parse_file_name(time=tm_str, lng=lng, lat=lat, hight=hight)
+                add(FootprintSum.from_footprint(apply_layer(load_footprint(file), layer)))
+            except Exception as e:
+                logger.error(e)
+                not_exist_files.append(tm_str)
+        time = time.add(hours=1)
+    if accumulator:
+        return accumulator.result().mean(), not_exist_files
+    return sum_footprints(parts).mean(), not_exist_files
+
+
+def parse_receptor_ids(receptor_ids: typing.Optional[str]) -> typing.List[int]:
+    """解析逗号分隔的受体 id, 去重并保持顺序, 最多 STILT_BATCH_MAX_RECEPTORS 个"""
+    ids = list(dict.fromkeys(int(i) for i in (receptor_ids or "").split(",") if i.strip()))
+    if len(ids) > cfg.STILT_BATCH_MAX_RECEPTORS:
+        raise ValueError(f"At most {cfg.STILT_BATCH_MAX_RECEPTORS} receptors per request")
+    return ids
+
+
+def receptor_files(
+    time: str, receptors: typing.List[typing.Tuple[int, float, float, int]]
+) -> typing.Tuple[typing.Dict[int, Path], typing.List[int]]:
+    """
+    多个受体同一时间的足迹文件
+    receptors: [(受体 id, 经度, 纬度, 高度)]
+    返回 ({受体 id: 文件}, 缺失足迹的受体 id), 文件按 receptors 的顺序
+    """
+    files, missing = {}, []
+    for receptor_id, lng, lat, hight in receptors:
+        try:
+            files[receptor_id] = parse_file_name(time=time, lng=lng, lat=lat, hight=hight)
+        except FileNotFoundError:
+            missing.append(receptor_id)
+    return files, missing
+
+
+def load_footprints(
+    files: typing.Dict[typing.Any, Path], layer: typing.Union[str, int] = "sum"
+) -> typing.Dict[typing.Any, Footprint]:
+    """多线程读取多个足迹文件并选择时间层, 返回的足迹与 files 的顺序一致"""
+    workers = max(1, min(cfg.STILT_BATCH_WORKERS, len(files)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        footprints = executor.map(
+            lambda file: apply_layer(load_footprint(file), layer), files.values()
+        )
+        return dict(zip(files.keys(), footprints))
+
+
+def total_footprints(footprints: typing.Iterable[Footprint]) -> Footprint:
+    """多个足迹按经纬度逐网格求和"""
+    return sum_footprints([FootprintSum.from_footprint(f) for f in footprints]).total()
 
 
 async def netcdf_to_data(
@@ -39,64 +311,17 @@ async def netcdf_to_data(
 ):
     # file_stream = file.file
     netcdf_bytes = await file.read()
-    fh = Dataset(file.filename, mode="r", memory=netcdf_bytes)
-    # 获取每个变量的值
-    lons = fh.variables["lon"][:]
-    lats = fh.variables["lat"][:]
-    foot = fh.variables["foot"][:]
-
-    # lons 保留6位小数
-    lons = np.round(lons, 6)
-    lats = np.round(lats, 6)
-
-    # 有效值过滤
-    foot_masked = foot > 0
-    time_indices, lat_indices, lng_indices = np.where(foot_masked)
-
-    # 获取有效值
-    data = [
-        (lons[j], lats[i], foot[t, i, j]) for t, i, j in zip(time_indices, lat_indices, lng_indices)
-    ]
-
-    fh.close()
+    with Dataset(file.filename, mode="r", memory=netcdf_bytes) as fh:
+        _, lngs, lats, vals = read_footprint_cells(fh)
+
+    data = np.column_stack((lngs, lats, vals)).astype(np.float64, copy=False).tolist()
     res = ("lng", "lat", "val"), data
     return res
 
 
 def stilt_to_png(data, rect_unit=0.005):
-    # 解析数据
-    data_array = np.array(data["data"])
-    lng, lat, val = data_array[:, 0], data_array[:, 1], np.log10(data_array[:, 2])
-
-    # 过滤值
-    mask = val >= -4
-    lng, lat, val = lng[mask], lat[mask], val[mask]
-
-    fig, ax = plt.subplots(figsize=(10, 6), dpi=300, frameon=False)
-    ax.set_position([0, 0, 1, 1])  # 去除所有外边距
-
-    # 颜色映射
-    cmap = plt.get_cmap("BuPu")
-    norm = Normalize(vmin=-4, vmax=max(val))
-
-    # 批量创建矩形
-    rects = [
-        Rectangle((x - rect_unit / 2, y - rect_unit / 2), rect_unit, rect_unit)
-        for x, y in zip(lng, lat)
-    ]
-    patch_collection = PatchCollection(rects, cmap=cmap, norm=norm, alpha=0.75, edgecolor=None)
-    patch_collection.set_array(val)
-    ax.add_collection(patch_collection)
-
-    # 设置范围
-    ax.set_xlim(min(lng), max(lng))
-    ax.set_ylim(min(lat), max(lat))
-    ax.set_axis_off()
-
-    # 保存到内存
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png", bbox_inches="tight", pad_inches=0, transparent=True)
-    buffer.seek(0)
-    plt.close()
-
-    return buffer
+    """足迹渲染为 3000 x 1800 的 png, 每个网格为边长 rect_unit 度的方块, 范围为网格中心的范围"""
+    data_array = np.asarray(data["data"], dtype=np.float64).reshape(-1, len(data["columns"]))
+    return utils_render.render_cells(
+        data_array[:, 0], data_array[:, 1], data_array[:, 2], rect_unit=rect_unit
+    )
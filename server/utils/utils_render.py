@@ -0,0 +1,126 @@
+"""
+足迹栅格渲染
+
+直接在 NumPy 数组上栅格化, 按颜色查找表上色后编码为 png,
+不使用 pyplot 的全局状态, 可以在多个线程中同时调用。
+"""
+
+import typing
+from io import BytesIO
+
+import matplotlib
+import numpy as np
+from matplotlib.image import imsave
+
+# 与原 matplotlib 渲染一致: log10 下限, 透明度, 颜色
+LOG_VMIN = -4
+ALPHA = 0.75
+CMAP = "BuPu"
+# 颜色查找表 (256, 4) uint8
+LUT = matplotlib.colormaps[CMAP](np.linspace(0, 1, 256), bytes=True)
+
+
+def colorize(log_val: np.ndarray, alpha, vmin: float, vmax: float) -> np.ndarray:
+    """log10 值按查找表上色, alpha 为 0 ~ 1 的透明度, 返回 (..., 4) uint8"""
+    scale = max(vmax - vmin, 1e-12)
+    index = np.clip(((log_val - vmin) / scale * LUT.shape[0]), 0, LUT.shape[0] - 1)
+    rgba = LUT[np.nan_to_num(index).astype(np.intp)]
+    rgba[..., 3] = np.round(np.asarray(alpha) * 255).astype(np.uint8)
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> BytesIO:
+    buffer = BytesIO()
+    imsave(buffer, rgba, format="png")
+    buffer.seek(0)
+    return buffer
+
+
+def _slices(ndim: int, axis: int, part: slice) -> tuple:
+    index = [slice(None)] * ndim
+    index[axis] = part
+    return tuple(index)
+
+
+def _max_filter(a: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """out[i] = max(a[i - size + 1 : i + 1]), 倍增平移, 复杂度 O(log size)"""
+    out, width = a, 1
+    while width < size:
+        step = min(width, size - width)
+        prev, out = out, out.copy()
+        head = _slices(a.ndim, axis, slice(step, None))
+        tail = _slices(a.ndim, axis, slice(None, -step))
+        np.maximum(out[head], prev[tail], out=out[head])
+        width += step
+    return out
+
+
+def _box_sum(a: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """out[i] = sum(a[i - size + 1 : i + 1])"""
+    out = np.cumsum(a, axis=axis, dtype=a.dtype)
+    head = _slices(a.ndim, axis, slice(size, None))
+    tail = _slices(a.ndim, axis, slice(None, -size))
+    out[head] -= out[tail].copy()
+    return out
+
+
+def render_cells(
+    lng: np.ndarray,
+    lat: np.ndarray,
+    val: np.ndarray,
+    rect_unit: float = 0.005,
+    width: int = 3000,
+    height: int = 1800,
+    extent: typing.Optional[typing.Tuple[float, float, float, float]] = None,
+) -> BytesIO:
+    """
+    每个网格绘制为中心在 (lng, lat), 边长 rect_unit 度的方块, 按输入顺序后绘制的在上层,
+    重叠部分的透明度按 alpha 叠加; 值取 log10, 低于 LOG_VMIN 的网格不绘制
+    extent: (min_lng, max_lng, min_lat, max_lat), 默认为网格中心的范围
+    """
+    with np.errstate(divide="ignore"):
+        log_val = np.log10(val)
+    mask = log_val >= LOG_VMIN
+    lng, lat, log_val = lng[mask], lat[mask], log_val[mask]
+    if log_val.size == 0:
+        return encode_png(np.zeros((height, width, 4), dtype=np.uint8))
+
+    x0, x1, y0, y1 = extent or (lng.min(), lng.max(), lat.min(), lat.max())
+    px_x = max(x1 - x0, rect_unit) / width
+    px_y = max(y1 - y0, rect_unit) / height
+    rect_w = max(1, int(round(rect_unit / px_x)))
+    rect_h = max(1, int(round(rect_unit / px_y)))
+
+    # 方块左上角所在像素, 行从上 (北) 到下
+    col = np.floor((lng - rect_unit / 2 - x0) / px_x).astype(np.int64)
+    row = np.floor((y1 - (lat + rect_unit / 2)) / px_y).astype(np.int64)
+    # 左上角在画布外的方块仍可能部分可见, 在扩展的画布上计算后裁剪
+    pad_x, pad_y = rect_w, rect_h
+    col, row = col + pad_x, row + pad_y
+    canvas = (height + 2 * pad_y, width + 2 * pad_x)
+    inside = (col >= 0) & (col < canvas[1]) & (row >= 0) & (row < canvas[0])
+    col, row, log_val = col[inside], row[inside], log_val[inside]
+
+    # 每个左上角像素保留最后绘制的网格, 再用最大值滤波找到覆盖每个像素的最上层网格
+    flat = row * canvas[1] + col
+    _, last = np.unique(flat[::-1], return_index=True)
+    last = flat.size - 1 - last
+    order = np.full(canvas[0] * canvas[1], -1, dtype=np.int32)
+    order[flat[last]] = last
+    order = order.reshape(canvas)
+    top = _max_filter(_max_filter(order, rect_h, axis=0), rect_w, axis=1)
+    # 覆盖每个像素的方块数, 透明度叠加 1 - (1 - alpha) ** n
+    anchors = np.bincount(flat, minlength=order.size).astype(np.int32).reshape(canvas)
+    layers = _box_sum(_box_sum(anchors, rect_h, axis=0), rect_w, axis=1)
+
+    top = top[pad_y : pad_y + height, pad_x : pad_x + width]
+    layers = layers[pad_y : pad_y + height, pad_x : pad_x + width]
+    # 先按网格上色, 末尾追加透明色, 无方块覆盖的像素 (top = -1) 取到透明色
+    colors = np.zeros((log_val.size + 1, 4), dtype=np.uint8)
+    colors[:-1] = colorize(log_val, 1.0, vmin=LOG_VMIN, vmax=float(log_val.max()))
+    rgba = colors[top]
+    # 叠加后的透明度按层数查表, 层数为 0 时透明
+    max_layers = rect_w * rect_h
+    alpha = np.round((1 - (1 - ALPHA) ** np.arange(max_layers + 1)) * 255).astype(np.uint8)
+    rgba[..., 3] = alpha[np.minimum(layers, max_layers)]
+    return encode_png(rgba)
@@ -0,0 +1,96 @@
+"""
+足迹 XYZ 栅格瓦片
+
+标准 web mercator 瓦片 (256 x 256), 每个像素取像素中心所在网格的足迹值,
+按缩放级别选择足迹金字塔层级, 渲染结果缓存在
+    {STILT_TILE_CACHE_PATH}/{受体}/{时间}/{z}/{x}/{y}.png
+足迹文件重新生成后 (mtime 更新) 缓存的瓦片自动失效。
+"""
+
+import os
+import typing
+from pathlib import Path
+
+import config as cfg
+import numpy as np
+from tasks.common_utils.footprint_store import Footprint
+from utils import utils_netcdf, utils_render
+
+TILE_SIZE = 256
+
+
+def tile_pixel_lnglat(z: int, x: int, y: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """瓦片每列像素中心的经度 (256,) 和每行像素中心的纬度 (256,), 行从北到南"""
+    world = TILE_SIZE * 2**z
+    px = (x * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / world
+    py = (y * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / world
+    lngs = px * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * py))))
+    return lngs, lats
+
+
+def axis_lookup(axis: np.ndarray, coords: np.ndarray) -> np.ndarray:
+    """坐标所在网格的索引, 网格边界取相邻网格中心的中点, 网格外为 -1"""
+    axis = np.asarray(axis, dtype=np.float64)
+    descending = axis.size > 1 and axis[0] > axis[-1]
+    if descending:
+        axis = axis[::-1]
+    half = (axis[1] - axis[0]) / 2 if axis.size > 1 else 0.0
+    edges = np.concatenate(([axis[0] - half], (axis[1:] + axis[:-1]) / 2, [axis[-1] + half]))
+    index = np.searchsorted(edges, coords, side="right") - 1
+    index[(index < 0) | (index >= axis.size)] = -1
+    if descending:
+        index[index >= 0] = axis.size - 1 - index[index >= 0]
+    return index
+
+
+def render_tile(footprint: Footprint, z: int, x: int, y: int) -> bytes:
+    """渲染瓦片 png, 无数据的像素透明"""
+    footprint = footprint.sum_layers()
+    lngs, lats = tile_pixel_lnglat(z, x, y)
+    ix = axis_lookup(footprint.lon, lngs)
+    iy = axis_lookup(footprint.lat, lats)
+
+    # 有效网格的扁平索引有序, 二分查找每个像素所在的网格
+    flat = iy[:, None] * footprint.nx + ix[None, :]
+    inside = (iy[:, None] >= 0) & (ix[None, :] >= 0)
+    pos = np.searchsorted(footprint.idx, flat)
+    pos[pos >= footprint.idx.size] = 0
+    hit = inside & (footprint.idx.size > 0) & (footprint.idx[pos] == flat)
+
+    val = np.full(flat.shape, -np.inf)
+    with np.errstate(divide="ignore"):
+        val[hit] = np.log10(footprint.val[pos[hit]])
+        vmax = float(np.log10(footprint.val.max())) if footprint.idx.size else 0.0
+    visible = hit & (val >= utils_render.LOG_VMIN)
+
+    rgba = utils_render.colorize(
+        val,
+        np.where(visible, utils_render.ALPHA, 0.0),
+        vmin=utils_render.LOG_VMIN,
+        vmax=vmax,
+    )
+    return utils_render.encode_png(rgba).getvalue()
+
+
+def tile_cache_file(receptor_key: str, time: str, z: int, x: int, y: int) -> Path:
+    return Path(cfg.STILT_TILE_CACHE_PATH, receptor_key, time, str(z), str(x), f"{y}.png")
+
+
+def get_tile(file: Path, cache_file: Path, z: int, x: int, y: int) -> bytes:
+    """读取缓存的瓦片, 缓存不存在或早于足迹文件时重新渲染"""
+    if cache_file.is_file() and cache_file.stat().st_mtime_ns >= file.stat().st_mtime_ns:
+        return cache_file.read_bytes()
+
+    footprint = utils_netcdf.load_footprint(file)
+    level = utils_netcdf.pyramid_level(footprint, zoom=z)
+    level_file, level = utils_netcdf.find_pyramid_file(file, level)
+    if level:
+        footprint = utils_netcdf.load_footprint(level_file)
+    content = render_tile(footprint, z, x, y)
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    tmp_file.write_bytes(content)
+    os.replace(tmp_file, cache_file)
+    return content